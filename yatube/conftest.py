@@ -0,0 +1 @@
+from posts.testing import query_budget  # noqa: F401
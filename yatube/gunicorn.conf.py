@@ -0,0 +1,21 @@
+"""Настройки gunicorn: gunicorn yatube.wsgi (файл подхватывается сам).
+
+Воркеры gthread обслуживают несколько запросов в потоках, поэтому
+ожидание базы или кэша в одном запросе не занимает весь процесс. Код
+проекта рассчитан на потоки: состояние запроса хранится в
+threading.local (yatube/instrumentation.py, yatube/routers.py), у
+каждого потока своё соединение с базой. Сравнить с одним потоком на
+воркер можно командой python manage.py bench_concurrency.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+keepalive = 5
+# Перезапуск воркеров ограничивает рост памяти от утечек
+max_requests = 2000
+max_requests_jitter = 200
+timeout = 30
@@ -1,29 +1,70 @@
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db.models import Q
 
 # Register your models here.
+from . import search
 from .models import Post, Group, Comment, Follow
+from .paginator import EstimatedCountPaginator
 
 
-class PostAdmin(admin.ModelAdmin):
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список без COUNT(*) по всей таблице и без второго подсчёта
+    «всего записей» при фильтрах."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = "-пусто-"
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = ("pk", "text", "pub_date", "author", "group")
+    list_select_related = ("author", "group")
     search_fields = ("text",)
     list_filter = ("pub_date",)
-    empty_value_display = "-пусто-"
+    raw_id_fields = ("author",)
+    autocomplete_fields = ("group",)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по полнотекстовому индексу (posts/search.py) вместо LIKE
+        if not search.tokenize(search_term):
+            return queryset, False
+        return queryset.filter(pk__in=search.matching_posts(search_term)), False
 
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ("pk", "title", "slug", "description",)
+    search_fields = ("title", "slug")
     empty_value_display = "-пусто-"
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ('post', 'author', 'text', 'created')
-    empty_value_display = "-пусто-"
+    list_select_related = ("post", "author")
+    search_fields = ("text",)
+    raw_id_fields = ("post", "author")
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search.tokenize(search_term):
+            return queryset, False
+        return queryset.filter(
+            pk__in=search.matching_comments(search_term)), False
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('user', 'author')
-    empty_value_display = "-пусто-"
+    list_select_related = ("user", "author")
+    search_fields = ("user__username", "author__username")
+    raw_id_fields = ("user", "author")
+
+    def get_search_results(self, request, queryset, search_term):
+        # Точное имя пользователя - по уникальному индексу auth_user
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        user_ids = get_user_model().objects.filter(
+            username=search_term).values("pk")
+        return queryset.filter(
+            Q(user__in=user_ids) | Q(author__in=user_ids)), False
 
 
 admin.site.register(Post, PostAdmin)
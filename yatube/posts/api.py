@@ -0,0 +1,333 @@
+"""JSON API над постами, группами, комментариями и подписками.
+
+Ленты и комментарии отдаются страницами по курсору: {"results": [...],
+"next": url, "previous": url}. Параметр ?fields=id,text,author оставляет
+в объектах только перечисленные поля, ?limit= меняет размер страницы
+(не больше MAX_LIMIT). Ленты берутся через тот же кэш, что и HTML-страницы
+(caching.feed_page), записи проверяются формами PostForm и CommentForm.
+
+На каждый ответ GET ставится ETag - хэш тела; повторный запрос с
+If-None-Match получает 304 без тела. Last-Modified не ставится: у поста
+нет времени изменения, и правка или новый комментарий его бы не сдвинули.
+Ответы сжимаются gzip, если клиент его принимает.
+
+Авторизация - сессией Django (как у сайта), поэтому запросы на запись
+проходят проверку CSRF: токен берётся из cookie csrftoken и передаётся в
+заголовке X-CSRFToken. Тело запроса - JSON или обычная форма (для
+загрузки картинки - multipart/form-data).
+"""
+import hashlib
+import json
+from functools import wraps
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import Http404, JsonResponse, QueryDict
+from django.http.multipartparser import MultiPartParserError
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.gzip import gzip_page
+
+from . import caching, thumbnails
+from .forms import CommentForm, PostForm
+from .models import Comment, Follow, Group, Post, UserStats
+from .paginator import CursorPaginator
+from .timeline import TimelinePaginator
+
+User = get_user_model()
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+
+class BadRequest(Exception):
+    status = 400
+
+
+class UnsupportedMediaType(BadRequest):
+    status = 415
+
+
+def person(user):
+    return {"username": user.username, "name": user.get_full_name()}
+
+
+POST_FIELDS = {
+    "id": lambda post: post.pk,
+    "text": lambda post: post.text,
+    "pub_date": lambda post: post.pub_date,
+    "author": lambda post: person(post.author),
+    "group": lambda post: post.group and {
+        "id": post.group.pk, "slug": post.group.slug,
+        "title": post.group.title},
+    "image": lambda post: post.image.url if post.image else None,
+    "comment_count": lambda post: post.comment_count,
+    "url": lambda post: reverse("api_post", args=[post.pk]),
+}
+
+COMMENT_FIELDS = {
+    "id": lambda comment: comment.pk,
+    "post": lambda comment: comment.post_id,
+    "text": lambda comment: comment.text,
+    "created": lambda comment: comment.created,
+    "author": lambda comment: person(comment.author),
+}
+
+GROUP_FIELDS = {
+    "id": lambda group: group.pk,
+    "slug": lambda group: group.slug,
+    "title": lambda group: group.title,
+    "description": lambda group: group.description,
+    "posts": lambda group: reverse("api_group_posts", args=[group.slug]),
+}
+
+
+def requested_fields(request, available):
+    fields = request.GET.get("fields")
+    if not fields:
+        return list(available)
+    fields = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise BadRequest("Неизвестные поля: %s" % ", ".join(unknown))
+    return fields
+
+
+def serialize(objects, request, available):
+    """Объекты в словари только с полями из ?fields=."""
+    getters = [(name, available[name])
+               for name in requested_fields(request, available)]
+    return [{name: getter(obj) for name, getter in getters} for obj in objects]
+
+
+def page_size(request):
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit должен быть числом")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def page_url(request, **params):
+    query = request.GET.copy()
+    query.update(params)
+    return "%s?%s" % (request.path, query.urlencode())
+
+
+def page_payload(request, page, available):
+    next_cursor = getattr(page, "next_cursor", None)
+    previous_cursor = getattr(page, "previous_cursor", None)
+    return {
+        "results": serialize(page, request, available),
+        "next": next_cursor and page_url(request, cursor=next_cursor),
+        "previous": previous_cursor and page_url(request, cursor=previous_cursor),
+    }
+
+
+def error(status, detail, **extra):
+    return JsonResponse(dict(extra, detail=detail), status=status,
+                        json_dumps_params={"ensure_ascii": False})
+
+
+def respond(request, data, status=200):
+    """Компактный JSON; для GET - ETag по телу и 304 при совпадении."""
+    response = JsonResponse(
+        data, status=status, safe=False, encoder=DjangoJSONEncoder,
+        json_dumps_params={"ensure_ascii": False, "separators": (",", ":")})
+    if request.method in ("GET", "HEAD") and status == 200:
+        etag = '"%s"' % hashlib.md5(response.content).hexdigest()
+        response["ETag"] = etag
+        not_modified = get_conditional_response(request, etag=etag,
+                                                response=response)
+        if not_modified is not None:
+            return not_modified
+    return response
+
+
+def request_data(request):
+    """Данные запроса для формы: JSON-объект или форма с файлами.
+
+    request.POST и request.FILES Django заполняет только для POST, поэтому
+    форму в теле PATCH разбираем сами."""
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            raise BadRequest("Тело запроса - не JSON")
+        if not isinstance(data, dict):
+            raise BadRequest("Ожидается JSON-объект")
+        return data, None
+    if request.method == "POST":
+        return request.POST, request.FILES
+    if request.content_type == "multipart/form-data":
+        try:
+            return request.parse_file_upload(
+                request.META, BytesIO(request.body))
+        except MultiPartParserError:
+            raise BadRequest("Не удалось разобрать multipart/form-data")
+    if request.content_type == "application/x-www-form-urlencoded":
+        return QueryDict(request.body, encoding=request.encoding), None
+    raise UnsupportedMediaType(
+        "Тело запроса - JSON, application/x-www-form-urlencoded "
+        "или multipart/form-data")
+
+
+def api_view(*methods, login=()):
+    """Разрешённые методы, вход для методов из login, ошибки - в JSON."""
+    allowed = set(methods) | ({"HEAD"} if "GET" in methods else set())
+
+    def decorator(view):
+        @gzip_page
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in allowed:
+                response = error(405, "Метод не поддерживается")
+                response["Allow"] = ", ".join(sorted(allowed))
+                return response
+            if request.method in login and not request.user.is_authenticated:
+                return error(401, "Требуется вход")
+            try:
+                return view(request, *args, **kwargs)
+            except Http404:
+                return error(404, "Не найдено")
+            except BadRequest as exc:
+                return error(exc.status, str(exc))
+        return wrapper
+    return decorator
+
+
+def feed_response(request, name, scopes, post_list, cursor_paginator=None):
+    if "page" in request.GET:
+        raise BadRequest("Страницы ленты - только по cursor")
+    limit = page_size(request)
+    if cursor_paginator is not None:
+        cursor_paginator.per_page = limit
+    page, _ = caching.feed_page(
+        request, "api:%s:%s" % (name, limit), scopes, post_list, limit,
+        cursor_paginator)
+    return respond(request, page_payload(request, page, POST_FIELDS))
+
+
+def save_post(form):
+    with transaction.atomic():
+        post = form.save()
+        if "image" in form.changed_data:
+            thumbnails.enqueue_post(post)
+    return post
+
+
+@api_view("GET", "POST", login=("POST",))
+def posts(request):
+    if request.method == "POST":
+        data, files = request_data(request)
+        form = PostForm(data, files)
+        if not form.is_valid():
+            return error(400, "Ошибка в данных", errors=form.errors)
+        form.instance.author = request.user
+        post = save_post(form)
+        return respond(request, serialize([post], request, POST_FIELDS)[0],
+                       status=201)
+    return feed_response(request, "index", ["index"], Post.objects.feed())
+
+
+@api_view("GET", "PATCH", login=("PATCH",))
+def post_detail(request, post_id):
+    if request.method == "PATCH":
+        post = get_object_or_404(Post, pk=post_id)
+        if post.author_id != request.user.pk:
+            return error(403, "Редактировать можно только свои посты")
+        data, files = request_data(request)
+        if isinstance(data, QueryDict):
+            data = data.dict()
+        # Частичное обновление: недостающие поля берутся из поста
+        data = dict({"text": post.text, "group": post.group_id}, **data)
+        form = PostForm(data, files, instance=post)
+        if not form.is_valid():
+            return error(400, "Ошибка в данных", errors=form.errors)
+        post = save_post(form)
+    else:
+        post = caching.get_post(post_id)
+        if post is None:
+            raise Http404
+    return respond(request, serialize([post], request, POST_FIELDS)[0])
+
+
+@api_view("GET", "POST", login=("POST",))
+def post_comments(request, post_id):
+    post = get_object_or_404(Post, pk=post_id)
+    if request.method == "POST":
+        data, _ = request_data(request)
+        form = CommentForm(data)
+        if not form.is_valid():
+            return error(400, "Ошибка в данных", errors=form.errors)
+        comment = form.save(commit=False)
+        comment.author = request.user
+        comment.post = post
+        with transaction.atomic():
+            comment.save()
+        return respond(request, serialize([comment], request, COMMENT_FIELDS)[0],
+                       status=201)
+    paginator = CursorPaginator(
+        Comment.objects.filter(post=post).select_related("author"),
+        page_size(request), ordering=("created", "pk"))
+    page = paginator.get_page(request.GET.get("cursor"))
+    return respond(request, page_payload(request, page, COMMENT_FIELDS))
+
+
+@api_view("GET")
+def groups(request):
+    return respond(request, serialize(
+        Group.objects.order_by("title"), request, GROUP_FIELDS))
+
+
+@api_view("GET")
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return feed_response(request, "group", ["group:%s" % group.pk],
+                         Post.objects.feed().filter(group=group))
+
+
+@api_view("GET")
+def user_detail(request, username):
+    user = get_object_or_404(
+        User.objects.select_related("stats"), username=username)
+    stats = UserStats.for_user(user)
+    following = (request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author=user).exists())
+    return respond(request, dict(
+        person(user), posts_count=stats.posts_count,
+        followers_count=stats.followers_count,
+        following_count=stats.following_count, following=following,
+        posts=reverse("api_user_posts", args=[user.username])))
+
+
+@api_view("GET")
+def user_posts(request, username):
+    user = get_object_or_404(User, username=username)
+    return feed_response(request, "profile", ["profile:%s" % user.pk],
+                         Post.objects.feed().filter(author=user))
+
+
+@api_view("POST", "DELETE", login=("POST", "DELETE"))
+def user_follow(request, username):
+    author = get_object_or_404(User, username=username)
+    if request.method == "DELETE":
+        with transaction.atomic():
+            Follow.objects.filter(user=request.user, author=author).delete()
+        return respond(request, {"following": False})
+    if author == request.user:
+        return error(400, "Нельзя подписаться на себя")
+    _, created = Follow.objects.get_or_create(user=request.user, author=author)
+    return respond(request, {"following": True}, status=201 if created else 200)
+
+
+@api_view("GET", login=("GET",))
+def follow_feed(request):
+    follows = Follow.objects.filter(user=request.user)
+    return feed_response(
+        request, "follow", ["follow:%s" % request.user.pk, "hot"],
+        Post.objects.feed().filter(author__in=follows.values_list("author")),
+        TimelinePaginator(request.user, DEFAULT_LIMIT))
@@ -0,0 +1,16 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path("posts/", api.posts, name="api_posts"),
+    path("posts/<int:post_id>/", api.post_detail, name="api_post"),
+    path("posts/<int:post_id>/comments/", api.post_comments,
+         name="api_post_comments"),
+    path("groups/", api.groups, name="api_groups"),
+    path("groups/<slug>/posts/", api.group_posts, name="api_group_posts"),
+    path("users/<username>/", api.user_detail, name="api_user"),
+    path("users/<username>/posts/", api.user_posts, name="api_user_posts"),
+    path("users/<username>/follow/", api.user_follow, name="api_user_follow"),
+    path("feed/", api.follow_feed, name="api_follow_feed"),
+]
@@ -0,0 +1,284 @@
+"""Кэш лент и страниц постов с инвалидацией по событиям.
+
+Лента кэшируется как «скелет» страницы: id постов и курсоры/номер
+страницы. Ключ скелета включает имя ленты, параметры ?cursor=/?page= и
+версии областей (scope), от которых зависит её состав: "index",
+"group:<id>", "profile:<id>", "follow:<id>" и "hot". Запись поста,
+подписки и т.п. удаляет версию области (см. posts/signals.py), и все
+закэшированные страницы этой области перестают находиться по ключу.
+Из тех же версий (плюс "post:<id>" и "user:<id>" - счётчики подписок)
+собираются ETag страниц, см. posts/conditional.py.
+
+Сами посты и страницы их комментариев кэшируются отдельно по id и
+сбрасываются при правке или новом комментарии, поэтому комментарий не
+сбрасывает ленты целиком. Посты отмечены версиями автора и группы
+(related_versions) и перечитываются после их переименования.
+Всё, что зависит от зрителя (подписка и т.п.), в кэш не попадает и
+вычисляется при каждом запросе; карточки постов кэшируются уже
+отрисованными в двух вариантах - для автора и для остальных (cards).
+"""
+import hashlib
+import threading
+from contextlib import contextmanager
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db import connection, transaction
+
+from . import timeline
+from .models import Comment, Follow, Post
+from .paginator import CursorPage, CursorPaginator, paginate
+
+VERSION_KEY = "posts:version:%s"
+FEED_KEY = "posts:feed:%s:%s"
+POST_KEY = "posts:post:%s"
+COMMENTS_KEY = "posts:comments:%s:%s"
+CARD_KEY = "posts:card:%s:%s:%s:%s"
+
+_snapshot = threading.local()
+
+
+def timeout():
+    return getattr(settings, "POSTS_CACHE_TIMEOUT", 300)
+
+
+@contextmanager
+def version_snapshot():
+    """Версии, прочитанные внутри блока, запоминаются и больше не
+    перечитываются: ETag страницы (conditional.py) и ключи кэша, по
+    которым она рисуется, строятся из одного набора версий."""
+    previous = getattr(_snapshot, "versions", None)
+    _snapshot.versions = {} if previous is None else previous
+    try:
+        yield
+    finally:
+        _snapshot.versions = previous
+
+
+def versions(scopes):
+    keys = [VERSION_KEY % scope for scope in scopes]
+    memo = getattr(_snapshot, "versions", None)
+    found = {key: memo[key] for key in keys if key in memo} if memo else {}
+    unknown = [key for key in keys if key not in found]
+    if unknown:
+        found.update(cache.get_many(unknown))
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid4().hex, None)
+        found.update(cache.get_many(missing))
+    if memo is not None:
+        memo.update(found)
+    return [found.get(key, "") for key in keys]
+
+
+def delete_keys(keys):
+    cache.delete_many(keys)
+    if connection.in_atomic_block:
+        # Пока транзакция не закоммичена, читатель может снова положить в
+        # кэш старое состояние, поэтому ключи удаляются ещё раз после COMMIT.
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate(*scopes):
+    keys = [VERSION_KEY % scope for scope in scopes]
+    memo = getattr(_snapshot, "versions", None)
+    for key in keys if memo else ():
+        memo.pop(key, None)
+    delete_keys(keys)
+
+
+def invalidate_followers(author_id):
+    """Сбрасывает ленты подписок подписчиков автора. Для популярных
+    авторов (см. timeline.py) сбрасывается общая область "hot"."""
+    if timeline.is_hot(author_id):
+        invalidate("hot")
+        return
+    followers = Follow.objects.filter(
+        author_id=author_id).values_list("user_id", flat=True)
+    batch = []
+    for user_id in followers.iterator():
+        batch.append("follow:%s" % user_id)
+        if len(batch) >= timeline.batch_size():
+            invalidate(*batch)
+            batch = []
+    invalidate(*batch)
+
+
+def forget_posts(*post_ids):
+    delete_keys([POST_KEY % pk for pk in post_ids]
+                + [VERSION_KEY % ("post:%s" % pk) for pk in post_ids])
+
+
+def related_scopes(post):
+    """Области автора и группы поста: их имя и название лежат в
+    закэшированном посте и карточке."""
+    return (["user:%s" % post.author_id]
+            + (["group:%s" % post.group_id] if post.group_id else []))
+
+
+def related_versions(posts):
+    """Сводная версия related_scopes каждого поста. Все версии читаются
+    одним get_many."""
+    scopes = {post.pk: related_scopes(post) for post in posts}
+    names = sorted({scope for value in scopes.values() for scope in value})
+    current = dict(zip(names, versions(names)))
+    return {pk: hashlib.md5("|".join(
+        current[scope] for scope in value).encode()).hexdigest()
+        for pk, value in scopes.items()}
+
+
+def stamp(posts):
+    """Отмечает посты текущими related_versions перед записью в кэш."""
+    current = related_versions(posts)
+    for post in posts:
+        post.related_version = current[post.pk]
+    return posts
+
+
+def fresh_posts(posts):
+    """Закэшированные посты, автор и группа которых с тех пор не менялись."""
+    current = related_versions(posts)
+    return [post for post in posts
+            if getattr(post, "related_version", None) == current[post.pk]]
+
+
+def get_posts(ids):
+    """Посты ленты по id в том же порядке: из кэша, промахи и посты с
+    переименованными автором или группой - одним запросом
+    Post.objects.feed()."""
+    keys = {pk: POST_KEY % pk for pk in ids}
+    found = cache.get_many(list(keys.values()))
+    posts = {post.pk: post for post in fresh_posts(
+        [found[key] for key in keys.values() if key in found])}
+    missing = [pk for pk in ids if pk not in posts]
+    if missing:
+        loaded = Post.objects.feed().in_bulk(missing)
+        stamp(list(loaded.values()))
+        cache.set_many({keys[pk]: post for pk, post in loaded.items()},
+                       timeout())
+        posts.update(loaded)
+    return [posts[pk] for pk in ids if pk in posts]
+
+
+def get_post(post_id):
+    posts = get_posts([post_id])
+    return posts[0] if posts else None
+
+
+def card_keys(posts, user):
+    unstamped = [post for post in posts
+                 if getattr(post, "related_version", None) is None]
+    related = related_versions(unstamped)
+    return [CARD_KEY % (post.pk, post.version, int(post.author_id == user.pk),
+                        related.get(post.pk) or post.related_version)
+            for post in posts]
+
+
+def cards(posts, user, render, cacheable=lambda post: True):
+    """HTML карточек постов: одним get_many из кэша, промахи рисуются
+    render(post) и сохраняются одним set_many.
+
+    Ключ - id и Post.version (растёт при правке и комментариях), признак
+    «зритель - автор», от которого зависит ссылка на правку, и
+    related_versions: в карточке имя автора и название группы.
+    """
+    keys = card_keys(posts, user)
+    found = cache.get_many(keys)
+    fresh = {}
+    html = []
+    for post, key in zip(posts, keys):
+        if key not in found:
+            found[key] = render(post)
+            if cacheable(post):
+                fresh[key] = found[key]
+        html.append(found[key])
+    if fresh:
+        cache.set_many(fresh, timeout())
+    return html
+
+
+def comments_per_page():
+    return getattr(settings, "POST_COMMENTS_PER_PAGE", 50)
+
+
+def comments_page(post, cursor=None):
+    """Страница комментариев поста по курсору, от старых к новым, с
+    авторами через JOIN. Ключ включает версию "post:<id>", поэтому новый
+    комментарий сбрасывает все закэшированные страницы поста."""
+    digest = hashlib.md5("|".join(
+        [str(cursor)] + versions(["post:%s" % post.pk])).encode()).hexdigest()
+    key = COMMENTS_KEY % (post.pk, digest)
+    page = cache.get(key)
+    if page is None:
+        paginator = CursorPaginator(
+            Comment.objects.filter(post=post).select_related("author"),
+            comments_per_page(), ordering=("created", "pk"))
+        page = paginator.get_page(cursor)
+        cache.set(key, page, timeout())
+    return page
+
+
+def feed_key(request, name, scopes):
+    params = "%s|%s" % (request.GET.get("page"), request.GET.get("cursor"))
+    digest = hashlib.md5(
+        "|".join([params] + versions(scopes)).encode()).hexdigest()
+    return FEED_KEY % (name, digest)
+
+
+def etag(parts, scopes):
+    """ETag из значений parts и текущих версий областей scopes."""
+    digest = hashlib.md5("|".join(
+        [str(part) for part in parts] + versions(scopes)).encode())
+    return '"%s"' % digest.hexdigest()
+
+
+def feed_etag(request, name, scopes, parts=(), extra_scopes=()):
+    """ETag страницы ленты без её построения: по закэшированному скелету,
+    версиям его постов ("post:<id>" сбрасывается при правке и новом
+    комментарии) и их авторов и групп (related_scopes). Если скелета в
+    кэше нет - None."""
+    key = feed_key(request, name, scopes)
+    state = cache.get(key)
+    if state is None or "related" not in state:
+        return None
+    return etag([key, *parts],
+                ["post:%s" % pk for pk in state["ids"]] + state["related"]
+                + list(extra_scopes))
+
+
+def feed_page(request, name, scopes, post_list, per_page,
+              cursor_paginator=None):
+    """Как paginate(), но скелет страницы берётся из кэша."""
+    key = feed_key(request, name, scopes)
+    state = cache.get(key)
+    if state is None:
+        page, paginator = paginate(request, post_list, per_page,
+                                   cursor_paginator)
+        cache.add(key, snapshot(page, paginator), timeout())
+        return page, paginator
+
+    posts = get_posts(state["ids"])
+    if "number" in state:
+        paginator = Paginator(post_list.order_by("-pub_date", "-pk"),
+                              per_page)
+        paginator.count = state["count"]
+        return Page(posts, state["number"], paginator), paginator
+    paginator = cursor_paginator or CursorPaginator(post_list, per_page)
+    return CursorPage(posts, state["next"], state["previous"]), paginator
+
+
+def snapshot(page, paginator):
+    cache.set_many({POST_KEY % post.pk: post for post in stamp(list(page))},
+                   timeout())
+    state = {"ids": [post.pk for post in page],
+             "related": sorted({scope for post in page
+                                for scope in related_scopes(post)})}
+    if getattr(paginator, "cursor_mode", False):
+        state.update(next=page.next_cursor, previous=page.previous_cursor)
+    else:
+        state.update(number=page.number, count=paginator.count)
+    return state
+
@@ -0,0 +1,134 @@
+"""HTTP-кэширование HTML-страниц: ETag, Cache-Control и Vary.
+
+ETag страницы считается до вызова вьюхи из версий областей кэша (см.
+caching.py): ленты - по закэшированному скелету страницы и версиям его
+постов, их авторов и групп, страница поста - по версиям поста, автора и
+группы. Если ETag совпал с If-None-Match, ответ 304 уходит без
+рендеринга. Версии читаются один раз (caching.version_snapshot), и вьюха
+рисует страницу по тем же версиям, поэтому запись во время рендеринга
+не достанется старой разметке под новым ETag. Пока скелета ленты в кэше
+нет, ответ уходит без ETag - его получит следующий запрос.
+
+В ETag входит зритель (пользователь и версия его подписок), поэтому
+страницы вошедших пользователей помечаются private, no-cache: браузер
+хранит их сам и каждый раз переспрашивает. Страницы анонимов - public
+с s-maxage=HTML_EDGE_CACHE_SECONDS для CDN; Vary: Cookie отделяет их от
+страниц с сессией. Last-Modified не ставится: у поста нет времени
+изменения, а pub_date не меняется при правке и комментариях.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+
+from . import caching
+from .models import Group
+
+User = get_user_model()
+
+
+def edge_seconds():
+    return getattr(settings, "HTML_EDGE_CACHE_SECONDS", 30)
+
+
+def viewer(request):
+    """Части ETag и области, которые зависят от зрителя."""
+    if request.user.is_authenticated:
+        return ["user=%s" % request.user.pk], ["follow:%s" % request.user.pk]
+    return ["anonymous"], []
+
+
+def patch_caching_headers(request, response):
+    if request.user.is_authenticated or response.cookies:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=0,
+                            s_maxage=edge_seconds())
+    patch_vary_headers(response, ["Cookie"])
+
+
+def conditional_page(etag_func):
+    """Декоратор вьюхи: 304 по ETag из etag_func(request, *args, **kwargs)
+    и заголовки кэширования. etag_func возвращает None, если ETag без
+    рендеринга не посчитать."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            response = None
+            with caching.version_snapshot():
+                etag = etag_func(request, *args, **kwargs)
+                if etag is not None:
+                    response = get_conditional_response(request, etag=etag)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+            if etag is not None:
+                response["ETag"] = etag
+            patch_caching_headers(request, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def index_etag(request):
+    parts, scopes = viewer(request)
+    return caching.feed_etag(request, "index", ["index"], parts, scopes)
+
+
+def lookup_pk(request, queryset, **filters):
+    """id по slug или имени; запоминается в запросе."""
+    key = (queryset.model, tuple(sorted(filters.items())))
+    found = request.__dict__.setdefault("_etag_lookups", {})
+    if key not in found:
+        found[key] = queryset.filter(**filters).values_list(
+            "pk", flat=True).first()
+    return found[key]
+
+
+def group_etag(request, slug):
+    pk = lookup_pk(request, Group.objects, slug=slug)
+    if pk is None:
+        return None
+    parts, scopes = viewer(request)
+    return caching.feed_etag(request, "group", ["group:%s" % pk], parts,
+                             scopes)
+
+
+def profile_etag(request, username):
+    pk = lookup_pk(request, User.objects, username=username)
+    if pk is None:
+        return None
+    parts, scopes = viewer(request)
+    return caching.feed_etag(request, "profile", ["profile:%s" % pk], parts,
+                             scopes + ["user:%s" % pk])
+
+
+def post_etag(request, username, post_id):
+    post = caching.get_post(post_id)
+    if post is None or post.author.username != username:
+        return None
+    parts, scopes = viewer(request)
+    return caching.etag(
+        ["post", post_id, username] + parts,
+        ["post:%s" % post_id, "profile:%s" % post.author_id]
+        + caching.related_scopes(post) + scopes)
+
+
+def follow_etag(request):
+    parts, scopes = viewer(request)
+    return caching.feed_etag(
+        request, "follow", ["follow:%s" % request.user.pk, "hot"], parts,
+        scopes)
+
+
+def comments_etag(request, username, post_id):
+    # Фрагмент комментариев одинаков для всех зрителей
+    return caching.etag(
+        ["comments", post_id, username, request.GET.get("cursor")],
+        ["post:%s" % post_id])
@@ -1,5 +1,6 @@
 from django.forms import ModelForm
 from .models import Post, Comment
+from .uploads import BoundedImageField
 from django import forms
 
 
@@ -15,6 +16,7 @@ class PostForm(ModelForm):
         help_texts = {
             'group': 'Сообщество для публикации',
         }
+        field_classes = {'image': BoundedImageField}
 
 
 class CommentForm(ModelForm):
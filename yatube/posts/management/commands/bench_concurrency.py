@@ -0,0 +1,127 @@
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+
+
+class PooledWSGIServer(WSGIServer):
+    """WSGI-сервер с пулом потоков, как воркер gunicorn gthread."""
+    threads = 1
+
+    def server_activate(self):
+        super().server_activate()
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def with_db_latency(application, seconds):
+    """Добавляет к каждому SQL-запросу задержку: локальная SQLite
+    отвечает мгновенно, а настоящая база - через сеть."""
+    if not seconds:
+        return application
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def wrapped(environ, start_response):
+        with connection.execute_wrapper(delay):
+            return list(application(environ, start_response))
+
+    return wrapped
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает пропускную способность WSGI-приложения с одним и "
+            "несколькими потоками на воркер под параллельной нагрузкой")
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="*", default=["/"])
+        parser.add_argument("--threads", type=int, nargs="+", default=[1, 8],
+                            help="Потоков в воркере для каждого прогона")
+        parser.add_argument("--concurrency", type=int, default=16,
+                            help="Одновременных клиентов")
+        parser.add_argument("--duration", type=float, default=5,
+                            help="Секунд на прогон")
+        parser.add_argument(
+            "--db-latency", type=float, default=0, metavar="MS",
+            help="Задержка на SQL-запрос, имитирует сетевую базу")
+
+    def handle(self, *args, urls, threads, concurrency, duration, db_latency,
+               **options):
+        application = with_db_latency(get_wsgi_application(),
+                                      db_latency / 1000)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{concurrency} клиентов, {duration} с, задержка БД {db_latency} мс"))
+        self.stdout.write(f"{'потоков':>8}{'запр/с':>10}{'p50 мс':>9}"
+                          f"{'p95 мс':>9}{'ошибок':>8}")
+        for count in threads:
+            server_class = type("Server", (PooledWSGIServer,), {"threads": count})
+            server = make_server("127.0.0.1", 0, application,
+                                 server_class=server_class,
+                                 handler_class=QuietHandler)
+            serving = threading.Thread(target=server.serve_forever, daemon=True)
+            serving.start()
+            try:
+                base = "http://127.0.0.1:%s" % server.server_port
+                latencies, errors = self.load(
+                    [base + url for url in urls], concurrency, duration)
+            finally:
+                server.shutdown()
+                server.server_close()
+            if not latencies:
+                raise CommandError(f"Ни одного успешного ответа ({errors} ошибок)")
+            latencies.sort()
+            self.stdout.write(
+                f"{count:8d}{len(latencies) / duration:10.1f}"
+                f"{statistics.median(latencies):9.2f}"
+                f"{latencies[int(len(latencies) * 0.95)]:9.2f}{errors:8d}")
+
+    def load(self, urls, concurrency, duration):
+        deadline = time.monotonic() + duration
+
+        def client(number):
+            latencies, errors = [], 0
+            position = number
+            while time.monotonic() < deadline:
+                url = urls[position % len(urls)]
+                position += 1
+                started = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(url, timeout=30) as response:
+                        response.read()
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+            return latencies, errors
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(client, range(concurrency)))
+        return ([latency for latencies, _ in results for latency in latencies],
+                sum(errors for _, errors in results))
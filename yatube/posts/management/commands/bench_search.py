@@ -0,0 +1,64 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+from posts import search
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает поиск по индексу с LIKE '%слово%' по постам и "
+            "комментариям: первая страница и число результатов")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "queries", nargs="*",
+            help="Запросы; по умолчанию - случайные слова из постов")
+        parser.add_argument("--sample", type=int, default=5)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, queries, sample, repeat, **options):
+        queries = queries or self.sample_queries(sample)
+        backend = search.backend()
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Индекс: {type(backend).__name__}, медиана из {repeat}, мс"))
+        for query in queries:
+            like = self.measure(lambda: self.like_page(query), repeat)
+            indexed = self.measure(lambda: self.search_page(query), repeat)
+            self.stdout.write(
+                f"{query[:24]:<24} LIKE {like:9.2f}   индекс {indexed:9.2f}"
+                f"   x{like / (indexed or 1e-9):.1f}")
+
+    def sample_queries(self, count):
+        texts = list(Post.objects.order_by("?").values_list("text", flat=True)[:count])
+        if not texts:
+            raise CommandError("В базе нет постов: заполните её, например "
+                               "python manage.py explain_feeds --seed N")
+        rng = random.Random(0)
+        return [rng.choice(search.tokenize(text) or ["post"]) for text in texts]
+
+    def like_page(self, query):
+        condition = Q()
+        for term in search.tokenize(query):
+            condition &= Q(text__icontains=term) | Q(comments__text__icontains=term)
+        posts = Post.objects.feed().filter(condition).distinct().order_by("-pub_date")
+        paginator = Paginator(posts, 10)
+        return list(paginator.get_page(1))
+
+    def search_page(self, query):
+        # Без кэша постов, чтобы сравнение с LIKE было честным
+        backend = search.backend()
+        backend.count(query)
+        return list(Post.objects.feed().in_bulk(backend.ids(query, 0, 10)).values())
+
+    def measure(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
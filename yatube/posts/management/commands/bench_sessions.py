@@ -0,0 +1,77 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import UserStats
+
+from .bench_views import percentile
+
+SCENARIOS = [
+    ("db", 0),
+    ("db", None),
+    ("cached_db", None),
+    ("signed_cookies", None),
+]
+
+
+def auth_query(sql):
+    return "django_session" in sql or '"auth_user"' in sql
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает движки сессий и кэш пользователя сессии: сколько "
+            "запросов к django_session и auth_user остаётся на index и "
+            "follow_index у вошедшего пользователя. Данные - из "
+            "python manage.py seed")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50,
+                            help="Запросов на каждую страницу")
+
+    def handle(self, *args, requests, **options):
+        reader = UserStats.objects.select_related("user").order_by(
+            "-following_count").first()
+        if reader is None:
+            raise CommandError("В базе нет данных: python manage.py seed")
+        pages = [("index", reverse("index")),
+                 ("follow_index", reverse("follow_index"))]
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{requests} запросов на страницу, кэш прогрет"))
+        self.stdout.write(f"{'сессии':<16}{'кэш польз.':>11}{'страница':>14}"
+                          f"{'запросы':>9}{'сессия+польз.':>15}{'p50 мс':>9}")
+        for engine, user_timeout in SCENARIOS:
+            if user_timeout is None:
+                user_timeout = settings.AUTH_USER_CACHE_TIMEOUT or 30
+            with override_settings(
+                    SESSION_ENGINE=settings.SESSION_ENGINES[engine],
+                    AUTH_USER_CACHE_TIMEOUT=user_timeout):
+                client = Client()
+                client.force_login(reader.user)
+                for name, url in pages:
+                    total, auth, p50 = self.measure(client, url, requests)
+                    self.stdout.write(
+                        f"{engine:<16}{'да' if user_timeout else 'нет':>11}"
+                        f"{name:>14}{total:9d}{auth:15d}{p50:9.2f}")
+
+    def measure(self, client, url, requests):
+        # Первый запрос прогревает ленту, сессию и пользователя в кэше
+        client.get(url)
+        timings, totals, auth = [], [], []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f"{url}: ответ {response.status_code}")
+            queries = [query["sql"] for query in context.captured_queries]
+            totals.append(len(queries))
+            auth.append(len([sql for sql in queries if auth_query(sql)]))
+        return (int(statistics.median(totals)), int(statistics.median(auth)),
+                percentile(timings, 0.5))
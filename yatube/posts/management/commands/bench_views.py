@@ -0,0 +1,146 @@
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Follow, Group, Post, UserStats
+
+VM_STEP = 100
+
+
+def percentile(samples, share):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+class Command(BaseCommand):
+    help = ("Гоняет основные страницы через тестовый клиент и печатает "
+            "p50/p95, число запросов к БД и объём работы SQLite. "
+            "Данные - из python manage.py seed")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50,
+                            help="Запросов на каждую страницу")
+        parser.add_argument(
+            "--cold", action="store_true",
+            help="Очищать кэш перед каждым запросом")
+        parser.add_argument(
+            "--only", nargs="+", metavar="NAME",
+            help="Только эти сценарии (index, group_posts, ...)")
+        parser.add_argument("--max-p95", type=float, metavar="MS",
+                            help="Ошибка, если p95 какой-то страницы больше")
+        parser.add_argument("--max-queries", type=int,
+                            help="Ошибка, если страница делает больше запросов")
+
+    def handle(self, *args, requests, cold, only, max_p95, max_queries,
+               **options):
+        scenarios = self.scenarios()
+        if only:
+            scenarios = [s for s in scenarios if s[0].split()[0] in only]
+        mode = "холодный" if cold else "прогретый"
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{requests} запросов на страницу, кэш {mode}"))
+        self.stdout.write(f"{'страница':<22}{'p50 мс':>9}{'p95 мс':>9}"
+                          f"{'запросы':>9}{'VM тыс.':>9}{'SCAN':>6}")
+
+        failures = []
+        for name, url, user in scenarios:
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            timings, queries = self.measure(client, url, requests, cold)
+            steps, scans = self.inspect(client, url, cold)
+            p50, p95 = percentile(timings, 0.5), percentile(timings, 0.95)
+            self.stdout.write(
+                f"{name:<22}{p50:9.2f}{p95:9.2f}{queries:9d}"
+                f"{'-' if steps is None else f'{steps:.1f}':>9}"
+                f"{'-' if scans is None else scans:>6}")
+            if max_p95 is not None and p95 > max_p95:
+                failures.append(f"{name}: p95 {p95:.2f} мс > {max_p95}")
+            if max_queries is not None and queries > max_queries:
+                failures.append(f"{name}: {queries} запросов > {max_queries}")
+        if failures:
+            raise CommandError("Превышены пороги:\n" + "\n".join(failures))
+
+    def scenarios(self):
+        post = Post.objects.order_by("-comment_count").select_related(
+            "author").first()
+        group = Group.objects.filter(group_posts__isnull=False).first()
+        author = UserStats.objects.select_related("user").order_by(
+            "-posts_count").first()
+        reader = UserStats.objects.select_related("user").order_by(
+            "-following_count").first()
+        if not (post and group and author and reader
+                and Follow.objects.exists()):
+            raise CommandError("В базе нет данных: python manage.py seed")
+        return [
+            ("index", reverse("index"), None),
+            ("index ?page=50", reverse("index") + "?page=50", None),
+            ("group_posts", reverse("group", args=[group.slug]), None),
+            ("profile", reverse("profile", args=[author.user.username]),
+             None),
+            ("post_view", reverse(
+                "post", args=[post.author.username, post.pk]), None),
+            ("follow_index", reverse("follow_index"), reader.user),
+        ]
+
+    def get(self, client, url, cold):
+        if cold:
+            cache.clear()
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f"{url}: ответ {response.status_code}")
+        return response
+
+    def measure(self, client, url, requests, cold):
+        # Первый запрос прогревает кэш и соединение и в замер не входит
+        self.get(client, url, cold)
+        timings, queries = [], []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                self.get(client, url, cold)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+        return timings, int(statistics.median(queries))
+
+    def inspect(self, client, url, cold):
+        """Объём работы одного запроса: тысячи шагов виртуальной машины
+        SQLite (аналог «прочитанных строк») и число полных сканирований
+        таблиц в планах запросов. На других СУБД - (None, None)."""
+        if connection.vendor != "sqlite":
+            return None, None
+        steps = [0]
+
+        def count_steps():
+            steps[0] += 1
+            return 0
+
+        with CaptureQueriesContext(connection) as context, \
+                self.progress_handler(count_steps):
+            self.get(client, url, cold)
+        scans = 0
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if not query["sql"].startswith("SELECT"):
+                    continue
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                scans += sum(
+                    1 for row in cursor.fetchall()
+                    if row[-1].startswith("SCAN ") and " USING " not in row[-1])
+        return steps[0] * VM_STEP / 1000, scans
+
+    @contextmanager
+    def progress_handler(self, handler):
+        connection.ensure_connection()
+        connection.connection.set_progress_handler(handler, VM_STEP)
+        try:
+            yield
+        finally:
+            connection.connection.set_progress_handler(None, VM_STEP)
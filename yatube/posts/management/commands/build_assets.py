@@ -0,0 +1,67 @@
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube.assets import COMPRESSIBLE, HASHED_RE, SOURCE_PATTERNS, brotli
+
+try:
+    import sass
+except ImportError:
+    sass = None
+
+BOOTSTRAP_SCSS = "bootstrap/scss/bootstrap.scss"
+BOOTSTRAP_CSS = "bootstrap/dist/css/bootstrap.min.css"
+
+
+class Command(BaseCommand):
+    help = ("Собирает статику в STATIC_ROOT: хэшированные имена, "
+            "минификация и .gz/.br-копии (см. yatube/assets.py), "
+            "и печатает, сколько весят текстовые файлы до и после сжатия")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clear", action="store_true",
+                            help="Удалить старые файлы из STATIC_ROOT")
+        parser.add_argument(
+            "--scss", action="store_true",
+            help="Пересобрать %s из scss (нужен пакет libsass)" % BOOTSTRAP_CSS)
+
+    def handle(self, *args, clear, scss, **options):
+        if scss:
+            self.compile_bootstrap()
+        call_command("collectstatic", interactive=False, clear=clear,
+                     ignore_patterns=SOURCE_PATTERNS,
+                     verbosity=options["verbosity"] - 1)
+        totals = {"": 0, ".gz": 0, ".br": 0}
+        files = 0
+        for root, _, names in os.walk(settings.STATIC_ROOT):
+            for name in names:
+                if not (HASHED_RE.search(name) and name.endswith(COMPRESSIBLE)):
+                    continue
+                files += 1
+                path = os.path.join(root, name)
+                size = os.path.getsize(path)
+                totals[""] += size
+                for suffix in (".gz", ".br"):
+                    compressed = path + suffix
+                    totals[suffix] += (os.path.getsize(compressed)
+                                       if os.path.exists(compressed) else size)
+        brotli_total = (f"{totals['.br'] // 1024} КБ" if brotli is not None
+                        else "не установлен")
+        self.stdout.write(
+            f"{files} файлов: {totals[''] // 1024} КБ, gzip "
+            f"{totals['.gz'] // 1024} КБ, brotli {brotli_total}")
+
+    def compile_bootstrap(self):
+        if sass is None:
+            raise CommandError("Для --scss нужен пакет libsass")
+        source = finders.find(BOOTSTRAP_SCSS)
+        target = os.path.join(os.path.dirname(os.path.dirname(source)),
+                              "dist", "css", "bootstrap.min.css")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "w") as output:
+            output.write(sass.compile(filename=source,
+                                      output_style="compressed"))
+        self.stdout.write(f"Собран {target}")
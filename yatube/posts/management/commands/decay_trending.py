@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = ("Удаляет из рейтинга популярных постов затухшие записи; "
+            "запускать по расписанию, например раз в час")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild", action="store_true",
+            help="Пересчитать рейтинг по постам и комментариям заново")
+
+    def handle(self, *args, rebuild, **options):
+        if rebuild:
+            count = trending.rebuild()
+            self.stdout.write(f"Пересчитано постов: {count}")
+        deleted = trending.prune()
+        self.stdout.write(f"Удалено затухших: {deleted}")
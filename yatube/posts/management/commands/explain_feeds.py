@@ -0,0 +1,125 @@
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from posts.models import Comment, Follow, Group, Post, UserStats
+from posts.seeding import seed
+
+
+class Command(BaseCommand):
+    help = ("Показывает планы EXPLAIN и время запросов лент до и после "
+            "составных индексов Post, Comment и Follow. Замер «до» снимает "
+            "индексы внутри транзакции, которая затем откатывается")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed", type=int, default=0, metavar="POSTS",
+            help="Сначала создать столько постов (и пропорционально "
+                 "пользователей, комментариев и подписок)")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--skip-baseline", action="store_true",
+            help="Не снимать индексы для замера «до»")
+        parser.add_argument(
+            "--lock-tables", action="store_true",
+            help="Разрешить замер «до» не на SQLite: таблицы постов, "
+                 "комментариев и подписок будут заблокированы до его конца")
+
+    def handle(self, *args, seed, repeat, skip_baseline, lock_tables,
+               **options):
+        if not skip_baseline and connection.vendor != "sqlite" \
+                and not lock_tables:
+            raise CommandError(
+                "Замер «до» блокирует таблицы на время транзакции: "
+                "добавьте --lock-tables или --skip-baseline")
+        if seed:
+            self.stdout.write(f"Заполнение базы: {seed} постов")
+            self.seed(seed)
+
+        if not skip_baseline:
+            self.stdout.write(self.style.MIGRATE_HEADING("До: без индексов"))
+            with self.without_indexes():
+                before = self.measure(repeat)
+        self.stdout.write(self.style.MIGRATE_HEADING("После: с индексами"))
+        after = self.measure(repeat)
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Медиана, мс"))
+        for name, timing in after.items():
+            line = f"{name:<16} после {timing:8.3f}"
+            if not skip_baseline:
+                line = (f"{name:<16} до {before[name]:8.3f}   после "
+                        f"{timing:8.3f}   x{before[name] / (timing or 1e-9):.1f}")
+            self.stdout.write(line)
+
+    def seed(self, posts):
+        seed(users=max(posts // 100, 10), groups=max(posts // 5000, 5),
+             posts=posts, comments=posts * 2, follows=posts // 5,
+             log=self.stdout.write)
+
+    def shapes(self):
+        group = Group.objects.order_by("pk").first()
+        author = UserStats.objects.order_by("-posts_count").first()
+        post = Post.objects.order_by("-comment_count").first()
+        follow = Follow.objects.order_by("pk").first()
+        if not (group and author and post and follow):
+            raise CommandError("В базе нет данных: запустите с --seed N")
+        return {
+            "group feed": lambda: Post.objects.filter(
+                group=group).order_by("-pub_date", "-pk")[:10],
+            "profile feed": lambda: Post.objects.filter(
+                author_id=author.user_id).order_by("-pub_date", "-pk")[:10],
+            "post comments": lambda: Comment.objects.filter(
+                post=post).order_by("created", "pk")[:50],
+            "follow exists": lambda: Follow.objects.filter(
+                user_id=follow.user_id, author_id=follow.author_id)[:1],
+        }
+
+    def measure(self, repeat):
+        timings = {}
+        for name, build in self.shapes().items():
+            self.stdout.write(self.style.SQL_KEYWORD(name))
+            self.stdout.write(build().explain())
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(build())
+                samples.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(samples)
+        return timings
+
+    @contextmanager
+    def without_indexes(self):
+        """Индексы и уникальность Follow сняты только внутри транзакции:
+        по выходе (и при прерывании) она откатывается, и база остаётся
+        как была. SQLite меняет схему в транзакции лишь при выключенной
+        проверке внешних ключей, поэтому она выключается заранее."""
+        if connection.in_atomic_block:
+            raise CommandError("Замер «до» нельзя запускать внутри транзакции")
+        constraints = Follow._meta.constraints
+        connection.disable_constraint_checking()
+        try:
+            with transaction.atomic():
+                with connection.schema_editor() as editor:
+                    self.alter_indexes(editor.remove_index)
+                    # SQLite удаляет ограничение пересозданием таблицы по
+                    # Meta модели
+                    Follow._meta.constraints = []
+                    try:
+                        for constraint in constraints:
+                            editor.remove_constraint(Follow, constraint)
+                    finally:
+                        Follow._meta.constraints = constraints
+                try:
+                    yield
+                finally:
+                    transaction.set_rollback(True)
+        finally:
+            connection.enable_constraint_checking()
+
+    def alter_indexes(self, operation):
+        for model in (Post, Comment):
+            for index in model._meta.indexes:
+                operation(model, index)
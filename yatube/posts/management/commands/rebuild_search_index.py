@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = "Перестраивает поисковый индекс постов и комментариев целиком"
+
+    def handle(self, *args, **options):
+        backend = search.backend()
+        with transaction.atomic():
+            backend.rebuild()
+        self.stdout.write(f"Индекс {type(backend).__name__} перестроен")
@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Comment, Follow, Post, UserStats
+
+User = get_user_model()
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef("pk")}).order_by()
+        .values(field).annotate(count=Count("pk")).values("count")
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики UserStats и Post.comment_count"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=5000,
+            help="Сколько строк пересчитывать в одной транзакции")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Только показать, сколько счётчиков разошлось")
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        users = User.objects.filter(stats__isnull=True)
+        missing = users.count()
+        if missing and not dry_run:
+            UserStats.objects.bulk_create(
+                (UserStats(user_id=pk) for pk in users.values_list("pk", flat=True)),
+                batch_size=batch_size, ignore_conflicts=True)
+        self.stdout.write(f"UserStats: создано записей {missing}")
+
+        stats = {
+            "posts_count": count_of(Post, "author"),
+            "followers_count": count_of(Follow, "author"),
+            "following_count": count_of(Follow, "user"),
+        }
+        fixed = self.repair(UserStats.objects.all(), stats, batch_size, dry_run)
+        self.stdout.write(f"UserStats: расхождений {fixed}")
+
+        comments = {"comment_count": count_of(Comment, "post")}
+        fixed = self.repair(Post.objects.all(), comments, batch_size, dry_run)
+        self.stdout.write(f"Post.comment_count: расхождений {fixed}")
+
+    def repair(self, queryset, counters, batch_size, dry_run):
+        """Сверяет счётчики с фактическими значениями пачками по pk и
+        перезаписывает только разошедшиеся строки."""
+        actual = {f"actual_{field}": expr for field, expr in counters.items()}
+        drift = Q()
+        for field in counters:
+            drift |= ~Q(**{field: F(f"actual_{field}")})
+
+        fixed = 0
+        pks = queryset.order_by("pk").values_list("pk", flat=True)
+        last_pk = None
+        while True:
+            batch = pks if last_pk is None else pks.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                return fixed
+            last_pk = batch[-1]
+            with transaction.atomic():
+                drifted = list(
+                    queryset.filter(pk__in=batch).annotate(**actual)
+                    .filter(drift).values_list("pk", flat=True))
+                fixed += len(drifted)
+                if drifted and not dry_run:
+                    queryset.filter(pk__in=drifted).update(**counters)
@@ -0,0 +1,32 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from posts.seeding import seed
+
+
+class Command(BaseCommand):
+    help = ("Заполняет базу пользователями, группами, постами, "
+            "комментариями и подписками для нагрузочных замеров")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--groups", type=int, default=20)
+        parser.add_argument("--posts", type=int, default=100000)
+        parser.add_argument("--comments", type=int, default=200000)
+        parser.add_argument("--follows", type=int, default=20000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--days", type=int, default=365,
+            help="Даты постов и комментариев - за столько последних дней")
+        parser.add_argument(
+            "--alpha", type=float, default=1.1,
+            help="Показатель степенного закона для подписчиков и постов")
+        parser.add_argument("--random-seed", type=int, default=0)
+
+    def handle(self, *args, users, groups, posts, comments, follows,
+               batch_size, days, alpha, random_seed, **options):
+        seed(users=users, groups=groups, posts=posts, comments=comments,
+             follows=follows, batch_size=batch_size, days=days, alpha=alpha,
+             rng=random.Random(random_seed), log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS("Готово"))
@@ -0,0 +1,26 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ("Копирует основную SQLite-базу в реплики из DATABASE_REPLICAS: "
+            "локальная замена репликации для проверки yatube/routers.py")
+
+    def handle(self, *args, **options):
+        primary = connections["default"]
+        if primary.vendor != "sqlite":
+            raise CommandError("Реплики настоящей СУБД обновляет репликация")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("Реплик нет: задайте DB_REPLICA_NAME")
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            connections[alias].close()
+            target = sqlite3.connect(settings.DATABASES[alias]["NAME"])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f"{alias}: скопирована")
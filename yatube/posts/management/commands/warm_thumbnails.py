@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate, post_variants
+
+
+class Command(BaseCommand):
+    help = "Заранее создаёт миниатюры картинок всех постов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, workers, chunk_size, **options):
+        names = (Post.objects.exclude(image="").exclude(image__isnull=True)
+                 .values_list("image", flat=True).iterator(chunk_size=chunk_size))
+        variants = post_variants()
+        jobs = ((name, geometry, dict(thumbnail_options))
+                for name in names
+                for _, _, geometry, thumbnail_options in variants)
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            batch = list(islice(jobs, chunk_size))
+            while batch:
+                list(pool.map(lambda job: generate(*job), batch))
+                done += len(batch)
+                self.stdout.write(f"Готово: {done}")
+                batch = list(islice(jobs, chunk_size))
+        self.stdout.write(f"Миниатюр создано или проверено: {done}")
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.13 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+
+    duplicates = (Follow.objects.values('user_id', 'author_id')
+                  .annotate(first=models.Min('pk'), count=models.Count('pk'))
+                  .filter(count__gt=1))
+    for row in duplicates:
+        Follow.objects.filter(user_id=row['user_id'], author_id=row['author_id']).exclude(
+            pk=row['first']).delete()
+        for field, user_id in (('user', row['user_id']), ('author', row['author_id'])):
+            counter = 'following_count' if field == 'user' else 'followers_count'
+            UserStats.objects.filter(user_id=user_id).update(
+                **{counter: Follow.objects.filter(**{field + '_id': user_id}).count()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_timeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_follows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='post_author_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date', '-id'], name='post_group_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+    ]
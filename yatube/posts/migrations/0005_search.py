@@ -0,0 +1,82 @@
+# Generated by Django 2.2.13 on 2026-10-18 18:36
+
+import re
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.utils import OperationalError
+
+
+def tokenize(text):
+    # Копия posts.search.tokenize на момент миграции
+    return [word[:64] for word in re.findall(r"\w+", text.lower())]
+
+
+def build_postings(apps):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    SearchPosting = apps.get_model('posts', 'SearchPosting')
+
+    sources = (
+        ((pk, None, text) for pk, text in Post.objects.values_list('pk', 'text').iterator()),
+        ((post_id, pk, text) for pk, post_id, text
+         in Comment.objects.values_list('pk', 'post_id', 'text').iterator()),
+    )
+    for source in sources:
+        SearchPosting.objects.bulk_create(
+            (SearchPosting(term=term, post_id=post_id, comment_id=comment_id, count=count)
+             for post_id, comment_id, text in source
+             for term, count in Counter(tokenize(text)).items()),
+            batch_size=500)
+
+
+def create_fts_table(apps, schema_editor):
+    """На SQLite индекс поиска - таблица FTS5, на остальных СУБД -
+    SearchPosting (см. posts/search.py)."""
+    if schema_editor.connection.vendor != 'sqlite':
+        build_postings(apps)
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE posts_search USING fts5("
+            "text, post_id UNINDEXED, kind UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2')")
+    except OperationalError:
+        # SQLite собран без FTS5
+        build_postings(apps)
+        return
+    schema_editor.execute(
+        "INSERT INTO posts_search (rowid, text, post_id, kind) "
+        "SELECT id * 2, text, id, 0 FROM posts_post UNION ALL "
+        "SELECT id * 2 + 1, text, post_id, 1 FROM posts_comment")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS posts_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('count', models.PositiveIntegerField()),
+                ('comment', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Comment')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchposting',
+            index=models.Index(fields=['term', 'post'], name='search_term_post_idx'),
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -14,6 +14,13 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        """Посты для ленты: автор и группа через JOIN, чтобы post_item.html
+        не делал запросов на каждый пост (comment_count хранится в посте)."""
+        return self.select_related("author", "group")
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField(
@@ -23,6 +30,21 @@ class Post(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE,
                               blank=True, null=True, related_name="group_posts")
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    comment_count = models.IntegerField(default=0)
+    # Растёт при правке и новых комментариях: по нему кэшируются
+    # отрисованные карточки постов (см. caching.cards)
+    version = models.PositiveIntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        # Ленты группы и автора сортируются по (pub_date, id), см. paginator.py
+        indexes = [
+            models.Index(fields=["author", "-pub_date", "-id"],
+                         name="post_author_date_idx"),
+            models.Index(fields=["group", "-pub_date", "-id"],
+                         name="post_group_date_idx"),
+        ]
 
     def __str__(self):
         return self.text
@@ -36,9 +58,117 @@ class Comment(models.Model):
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "created"],
+                         name="comment_post_created_idx"),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="follower")
     author = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="following")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "author"], name="unique_follow"),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые обновляются вместе с записью
+    подписок, постов и комментариев (см. posts/signals.py)."""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    posts_count = models.IntegerField(default=0)
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+
+    @classmethod
+    def for_user(cls, user):
+        """Счётчики пользователя, загруженного с select_related("stats");
+        отсутствующая запись пересчитывается и создаётся на месте."""
+        try:
+            return user.stats
+        except cls.DoesNotExist:
+            return cls.rebuild(user.pk)
+
+    @classmethod
+    def rebuild(cls, user_id):
+        # Считаем по default: счётчики с отстающей реплики сохранились бы
+        # в основную базу и остались бы неверными
+        posts = Post.objects.using("default")
+        follows = Follow.objects.using("default")
+        stats, _ = cls.objects.update_or_create(user_id=user_id, defaults={
+            "posts_count": posts.filter(author_id=user_id).count(),
+            "followers_count": follows.filter(author_id=user_id).count(),
+            "following_count": follows.filter(user_id=user_id).count(),
+        })
+        return stats
+
+    @classmethod
+    def bump(cls, user_id, **deltas):
+        # Если записи нет, её пересчитает for_user() при первом чтении.
+        cls.objects.filter(user_id=user_id).update(**{
+            field: models.F(field) + delta for field, delta in deltas.items()
+        })
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: пост автора, разложенный
+    подписчику при публикации (см. posts/timeline.py)."""
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    author = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post"], name="unique_timeline_entry"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"],
+                         name="timeline_user_date_idx"),
+            models.Index(fields=["user", "author"],
+                         name="timeline_user_author_idx"),
+        ]
+
+
+class SearchPosting(models.Model):
+    """Строка инвертированного индекса для поиска без FTS5: слово и
+    сколько раз оно встречается в посте или комментарии (см. search.py)."""
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="+")
+    comment = models.ForeignKey(
+        Comment, on_delete=models.CASCADE, null=True, related_name="+")
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["term", "post"], name="search_term_post_idx"),
+        ]
+
+
+class TrendingPost(models.Model):
+    """Рейтинг популярных постов с затуханием по времени (см.
+    posts/trending.py). score хранится в логарифмической шкале и только
+    растёт, поэтому порядок по нему и есть порядок по текущему рейтингу."""
+    post = models.OneToOneField(
+        Post, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    group = models.ForeignKey(
+        Group, on_delete=models.CASCADE, null=True, related_name="+")
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-score", "-post"], name="trending_score_idx"),
+            models.Index(fields=["group", "-score", "-post"],
+                         name="trending_group_score_idx"),
+        ]
@@ -0,0 +1,192 @@
+import base64
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage(Sequence):
+    """Страница ленты, полученная по курсору, без COUNT и OFFSET."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return "<CursorPage next=%s previous=%s>" % (
+            self.next_cursor, self.previous_cursor)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset-пагинация по паре полей (по умолчанию (pub_date, id)).
+
+    Каждая страница - это один запрос вида
+    WHERE (pub_date, id) < (:pub_date, :id) ORDER BY pub_date DESC, id DESC
+    LIMIT per_page + 1, поэтому стоимость не зависит от глубины страницы.
+    Курсор - непрозрачный токен с ключом крайней записи и направлением.
+    """
+    cursor_mode = True
+
+    def __init__(self, object_list, per_page, ordering=("-pub_date", "-pk")):
+        self.object_list = object_list
+        self.model = object_list.model
+        self.per_page = int(per_page)
+        self.ordering = ordering
+        self.fields = [name.lstrip("-") for name in ordering]
+        self.descending = ordering[0].startswith("-")
+
+    def encode_cursor(self, obj, direction):
+        values = [str(getattr(obj, field)) for field in self.fields]
+        raw = "|".join([direction] + values)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding).decode()
+            direction, *values = raw.split("|")
+            if direction not in ("n", "p") or len(values) != len(self.fields):
+                raise ValueError
+            model = self.model
+            values = [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self._model_fields(model), values)
+            ]
+        except (ValueError, ValidationError) as exc:
+            raise InvalidCursor(cursor) from exc
+        return direction, values
+
+    def _model_fields(self, model):
+        return [model._meta.pk.name if field == "pk" else field
+                for field in self.fields]
+
+    def _seek(self, values, forward):
+        first, second = self.fields
+        lookup = "lt" if self.descending == forward else "gt"
+        return (Q(**{"%s__%s" % (first, lookup): values[0]})
+                | Q(**{first: values[0], "%s__%s" % (second, lookup): values[1]}))
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith("-") else "-" + name
+                for name in self.ordering]
+
+    def fetch(self, values, forward):
+        """Строки после ключа values (или с начала) в порядке обхода,
+        не больше per_page + 1."""
+        queryset, ordering = self.object_list, self.ordering
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, forward))
+        if not forward:
+            ordering = self._reversed_ordering()
+        return list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+    def page(self, cursor=None):
+        values, forward = None, True
+        if cursor is not None:
+            direction, values = self.decode_cursor(cursor)
+            forward = direction == "n"
+        rows = self.fetch(values, forward)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            return self._build(rows, has_next=has_more,
+                               has_previous=cursor is not None)
+        rows.reverse()
+        return self._build(rows, has_next=True, has_previous=has_more)
+
+    def get_page(self, cursor=None):
+        """Как Paginator.get_page: битый курсор ведёт на первую страницу."""
+        try:
+            return self.page(cursor or None)
+        except InvalidCursor:
+            return self.page()
+
+    def _build(self, rows, has_next, has_previous):
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor(rows[-1], "n")
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(rows[0], "p")
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+
+def estimate_count(model, using="default"):
+    """Примерное число строк таблицы из статистики СУБД или None:
+    reltuples в PostgreSQL, sqlite_stat1 (после ANALYZE) в SQLite."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(table)])
+        elif connection.vendor == "sqlite":
+            if "sqlite_stat1" not in connection.introspection.table_names(cursor):
+                return None
+            cursor.execute(
+                "SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 "
+                "WHERE tbl = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator для админки больших таблиц: для списка без фильтров
+    вместо COUNT(*) по всей таблице берётся оценка из статистики СУБД,
+    если она больше ADMIN_EXACT_COUNT_LIMIT. С фильтрами и на маленьких
+    таблицах число строк считается точно."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, "query", None)
+        if query is not None and not query.where and not query.distinct:
+            estimate = estimate_count(queryset.model, queryset.db)
+            limit = getattr(settings, "ADMIN_EXACT_COUNT_LIMIT", 100000)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return super().count
+
+
+def paginate(request, object_list, per_page, cursor_paginator=None):
+    """Возвращает (page, paginator) для ленты.
+
+    По умолчанию используется курсорная пагинация (?cursor=...), а старые
+    ссылки вида ?page=N обслуживаются классическим Paginator. Вместо
+    CursorPaginator(object_list) можно передать свой cursor_paginator.
+    """
+    page_number = request.GET.get("page")
+    if page_number is not None:
+        paginator = Paginator(object_list.order_by("-pub_date", "-pk"),
+                              per_page)
+        return paginator.get_page(page_number), paginator
+    paginator = cursor_paginator or CursorPaginator(object_list, per_page)
+    return paginator.get_page(request.GET.get("cursor")), paginator
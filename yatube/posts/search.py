@@ -0,0 +1,234 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+На SQLite используется виртуальная таблица FTS5 posts_search (создаётся
+миграцией 0005_search): одна строка на пост или комментарий, rowid =
+id * 2 + вид записи, поэтому обновление и удаление идут по rowid без
+сканирования. Ранжирование - bm25, совпадение в комментарии весит вдвое
+меньше совпадения в тексте поста.
+
+На других СУБД (или при POSTS_SEARCH_BACKEND = "index") работает
+инвертированный индекс в таблице SearchPosting: слово -> пост/комментарий
+и число вхождений, ранжирование - TF-IDF. Оба индекса обновляются
+сигналами при сохранении и удалении (см. posts/signals.py), а
+rebuild_search_index перестраивает активный индекс целиком.
+"""
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Count, F, FloatField, Sum, When
+from django.db.models.expressions import RawSQL
+
+from . import caching
+from .models import Comment, Post, SearchPosting
+
+FTS_TABLE = "posts_search"
+POST, COMMENT = 0, 1
+COMMENT_WEIGHT = 0.5
+WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return [word[:64] for word in WORD_RE.findall(text.lower())]
+
+
+def rowid(kind, pk):
+    return pk * 2 + kind
+
+
+class Fts5Backend:
+    def index(self, kind, pk, post_id, text):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s WHERE rowid = %%s" % FTS_TABLE,
+                           [rowid(kind, pk)])
+            cursor.execute(
+                "INSERT INTO %s (rowid, text, post_id, kind) "
+                "VALUES (%%s, %%s, %%s, %%s)" % FTS_TABLE,
+                [rowid(kind, pk), text, post_id, kind])
+
+    def remove(self, kind, pk):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s WHERE rowid = %%s" % FTS_TABLE,
+                           [rowid(kind, pk)])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s" % FTS_TABLE)
+            cursor.execute(
+                "INSERT INTO {table} (rowid, text, post_id, kind) "
+                "SELECT id * 2, text, id, 0 FROM {post} UNION ALL "
+                "SELECT id * 2 + 1, text, post_id, 1 FROM {comment}".format(
+                    table=FTS_TABLE, post=Post._meta.db_table,
+                    comment=Comment._meta.db_table))
+
+    def match(self, query):
+        # Каждое слово в кавычках: пользовательский ввод не станет
+        # синтаксисом FTS5 (OR, NEAR, * и т.п.)
+        return " ".join('"%s"' % term for term in tokenize(query))
+
+    def count(self, query):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(DISTINCT post_id) FROM %s WHERE %s MATCH %%s"
+                % (FTS_TABLE, FTS_TABLE), [self.match(query)])
+            return cursor.fetchone()[0]
+
+    def matching(self, query, kind):
+        """id постов (или комментариев), где есть все слова, для pk__in."""
+        return RawSQL(
+            "SELECT (rowid - %s) / 2 FROM {table} WHERE {table} MATCH %s"
+            " AND kind = %s".format(table=FTS_TABLE),
+            [kind, self.match(query), kind])
+
+    def ids(self, query, offset, limit):
+        # bm25() нельзя вызывать внутри агрегата, а LIMIT -1 не даёт
+        # SQLite развернуть подзапрос во внешний GROUP BY
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT post_id FROM ("
+                " SELECT post_id, CASE kind WHEN 1 THEN bm25({table}) * %s"
+                " ELSE bm25({table}) END AS score"
+                " FROM {table} WHERE {table} MATCH %s LIMIT -1"
+                ") GROUP BY post_id ORDER BY MIN(score), post_id DESC"
+                " LIMIT %s OFFSET %s".format(table=FTS_TABLE),
+                [COMMENT_WEIGHT, self.match(query), limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class IndexBackend:
+    def index(self, kind, pk, post_id, text):
+        comment_id = pk if kind == COMMENT else None
+        self.remove(kind, pk)
+        SearchPosting.objects.bulk_create(
+            SearchPosting(term=term, post_id=post_id, comment_id=comment_id,
+                          count=count)
+            for term, count in Counter(tokenize(text)).items())
+
+    def remove(self, kind, pk):
+        if kind == COMMENT:
+            SearchPosting.objects.filter(comment_id=pk).delete()
+        else:
+            SearchPosting.objects.filter(
+                post_id=pk, comment__isnull=True).delete()
+
+    def rebuild(self, batch_size=1000):
+        SearchPosting.objects.all().delete()
+        rows = ((pk, None, text) for pk, text
+                in Post.objects.values_list("pk", "text").iterator())
+        comments = ((post_id, pk, text) for pk, post_id, text
+                    in Comment.objects.values_list("pk", "post_id", "text").iterator())
+        batch = []
+        for source in (rows, comments):
+            for post_id, comment_id, text in source:
+                batch += [SearchPosting(term=term, post_id=post_id,
+                                        comment_id=comment_id, count=count)
+                          for term, count in Counter(tokenize(text)).items()]
+                if len(batch) >= batch_size:
+                    SearchPosting.objects.bulk_create(batch)
+                    batch = []
+        SearchPosting.objects.bulk_create(batch)
+
+    def ranked(self, query):
+        """Посты, где встречаются все слова запроса, по убыванию TF-IDF."""
+        terms = set(tokenize(query))
+        if not terms:
+            return SearchPosting.objects.none().values("post_id")
+        total = Post.objects.count() or 1
+        frequency = dict(SearchPosting.objects.filter(term__in=terms)
+                         .values_list("term").annotate(Count("post", distinct=True)))
+        whens = []
+        for term in terms:
+            weight = math.log(1 + total / frequency.get(term, 1))
+            whens += [
+                When(term=term, comment__isnull=True, then=F("count") * weight),
+                When(term=term, then=F("count") * weight * COMMENT_WEIGHT),
+            ]
+        return (SearchPosting.objects.filter(term__in=terms)
+                .values("post_id")
+                .annotate(matched=Count("term", distinct=True),
+                          score=Sum(Case(*whens, output_field=FloatField())))
+                .filter(matched=len(terms)))
+
+    def count(self, query):
+        return self.ranked(query).count()
+
+    def matching(self, query, kind):
+        terms = set(tokenize(query))
+        column = "comment_id" if kind == COMMENT else "post_id"
+        postings = SearchPosting.objects.filter(
+            term__in=terms, comment__isnull=kind != COMMENT)
+        return (postings.values(column)
+                .annotate(matched=Count("term", distinct=True))
+                .filter(matched=len(terms)).values(column))
+
+    def ids(self, query, offset, limit):
+        ranked = self.ranked(query).order_by("-score", "-post_id")
+        return [row["post_id"] for row in ranked[offset:offset + limit]]
+
+
+_has_fts_table = {}
+
+
+def backend():
+    name = getattr(settings, "POSTS_SEARCH_BACKEND", "auto")
+    if name == "auto":
+        alias = connection.settings_dict["NAME"]
+        if alias not in _has_fts_table:
+            _has_fts_table[alias] = (
+                connection.vendor == "sqlite"
+                and FTS_TABLE in connection.introspection.table_names())
+        name = "fts5" if _has_fts_table[alias] else "index"
+    return Fts5Backend() if name == "fts5" else IndexBackend()
+
+
+def matching_posts(query):
+    return backend().matching(query, POST)
+
+
+def matching_comments(query):
+    return backend().matching(query, COMMENT)
+
+
+def index_post(post):
+    backend().index(POST, post.pk, post.pk, post.text)
+
+
+def index_comment(comment):
+    backend().index(COMMENT, comment.pk, comment.post_id, comment.text)
+
+
+def remove_post(post_id):
+    backend().remove(POST, post_id)
+
+
+def remove_comment(comment_id):
+    backend().remove(COMMENT, comment_id)
+
+
+class SearchResults:
+    """Результаты поиска для django.core.paginator.Paginator: count() и
+    срезы, посты по id берутся через кэш (см. caching.get_posts)."""
+
+    def __init__(self, query):
+        self.query = query
+        self.backend = backend()
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.query) if tokenize(self.query) else 0
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        if not self.count():
+            return []
+        ids = self.backend.ids(self.query, start, index.stop - start)
+        return caching.get_posts(ids)
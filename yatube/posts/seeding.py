@@ -0,0 +1,133 @@
+"""Массовое заполнение базы тестовыми данными для замеров производительности.
+
+Все объекты создаются через bulk_create пачками, поэтому сигналы не
+срабатывают: счётчики и ленты подписок пересчитываются в конце.
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+
+from . import search, timeline
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+WORDS = (
+    "весна лето осень зима город река лес море дорога дом кот собака "
+    "музыка книга кино фото поезд утро вечер ночь друг работа отпуск "
+    "кофе чай дождь снег солнце горы парк мост окно сад рыбалка щука "
+    "футбол концерт выставка рецепт пирог велосипед поход палатка"
+).split()
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Отключает auto_now_add, чтобы bulk_create сохранил заданные даты."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def bulk_insert(model, objects, batch_size):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, batch_size))
+        if not batch:
+            return
+        model.objects.bulk_create(batch, ignore_conflicts=model is Follow)
+
+
+def zipf_weights(count, alpha):
+    """Накопленные веса рангов 1..count по закону Ципфа для rng.choices."""
+    return list(accumulate(1 / rank ** alpha for rank in range(1, count + 1)))
+
+
+def random_text(rng, words, weights, length):
+    return " ".join(rng.choices(words, cum_weights=weights, k=length))
+
+
+def seed(users=1000, groups=20, posts=100000, comments=200000,
+         follows=20000, batch_size=5000, days=365, alpha=1.1, rng=None,
+         log=print):
+    """Создаёт данные, похожие на настоящие: у немногих авторов много
+    подписчиков и постов (распределение Ципфа с показателем alpha), тексты
+    собраны из словаря с частыми и редкими словами."""
+    rng = rng or random.Random(0)
+    word_weights = zipf_weights(len(WORDS), 1)
+    now = timezone.now()
+    prefix = f"seed{now:%Y%m%d%H%M%S}"
+
+    def random_date():
+        return now - timedelta(seconds=rng.randrange(days * 24 * 3600))
+
+    log(f"Пользователи: {users}")
+    bulk_insert(User, (
+        User(username=f"{prefix}_{i}", password="!")
+        for i in range(users)), batch_size)
+    user_ids = list(User.objects.filter(
+        username__startswith=prefix).values_list("pk", flat=True))
+    # Чем меньше индекс в user_ids, тем популярнее и активнее автор
+    rng.shuffle(user_ids)
+    author_weights = zipf_weights(len(user_ids), alpha)
+
+    log(f"Группы: {groups}")
+    bulk_insert(Group, (
+        Group(title=f"Группа {i}", slug=f"{prefix}-{i}", description="")
+        for i in range(groups)), batch_size)
+    group_ids = list(Group.objects.filter(
+        slug__startswith=prefix).values_list("pk", flat=True))
+
+    log(f"Посты: {posts}")
+    with explicit_dates(Post._meta.get_field("pub_date")):
+        bulk_insert(Post, (
+            Post(author_id=rng.choices(user_ids, cum_weights=author_weights)[0],
+                 group_id=rng.choice(group_ids + [None]),
+                 text=f"Пост {i}: " + random_text(
+                     rng, WORDS, word_weights, rng.randint(5, 40)),
+                 pub_date=random_date())
+            for i in range(posts)), batch_size)
+    post_ids = list(Post.objects.filter(
+        author_id__in=user_ids).values_list("pk", flat=True))
+
+    log(f"Комментарии: {comments}")
+    with explicit_dates(Comment._meta.get_field("created")):
+        bulk_insert(Comment, (
+            Comment(post_id=rng.choice(post_ids),
+                    author_id=rng.choice(user_ids),
+                    text=random_text(rng, WORDS, word_weights,
+                                     rng.randint(2, 15)),
+                    created=random_date())
+            for i in range(comments)), batch_size)
+
+    log(f"Подписки: {follows}")
+    bulk_insert(Follow, (
+        Follow(user_id=user_id, author_id=author_id)
+        for user_id, author_id in follow_pairs(
+            user_ids, follows, rng, author_weights)
+        if user_id != author_id), batch_size)
+
+    log("Пересчёт счётчиков и лент подписок")
+    call_command("recount_stats", batch_size=batch_size, stdout=StringIO())
+    for follow in Follow.objects.filter(user_id__in=user_ids).iterator():
+        timeline.backfill(follow)
+    log("Перестройка поискового индекса")
+    search.backend().rebuild()
+    return user_ids
+
+
+def follow_pairs(user_ids, count, rng, author_weights=None):
+    """Подписчик выбирается равномерно, автор - по весам author_weights:
+    число подписчиков распределено по степенному закону."""
+    authors = rng.choices(user_ids, cum_weights=author_weights, k=count)
+    for author_id in authors:
+        yield rng.choice(user_ids), author_id
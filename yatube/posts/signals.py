@@ -0,0 +1,143 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching, search, timeline, trending
+from .models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+
+# Поля пользователя, которые видны на страницах или проверяются при входе
+USER_FIELDS = ("username", "first_name", "last_name", "is_active", "password")
+
+
+@receiver(pre_save, sender=User)
+def remember_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance.pk and not raw and update_fields is None:
+        instance._saved_user_fields = User.objects.filter(
+            pk=instance.pk).values_list(*USER_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False,
+                      update_fields=None, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+        # id удалённого пользователя может достаться новому
+        caching.invalidate("user:%s" % instance.pk)
+        return
+    if raw:
+        return
+    # Вход сохраняет только last_login - кэш автора не трогаем
+    if update_fields is not None:
+        if not set(update_fields) & set(USER_FIELDS):
+            return
+    elif getattr(instance, "_saved_user_fields", None) == tuple(
+            getattr(instance, field) for field in USER_FIELDS):
+        return
+    # Имя пользователя видно в профиле и на странице поста
+    caching.invalidate("user:%s" % instance.pk)
+
+
+def post_scopes(post):
+    scopes = ["index", "profile:%s" % post.author_id]
+    if post.group_id:
+        scopes.append("group:%s" % post.group_id)
+    return scopes
+
+
+@receiver(pre_save, sender=Post)
+def remember_group(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._saved_group_id = Post.objects.filter(
+            pk=instance.pk).values_list("group_id", flat=True).first()
+        # Версия растёт в том же UPDATE, что и правка, и не затирается
+        # значением, прочитанным до чужих изменений
+        instance.version = F("version") + 1
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    if raw:
+        return
+    search.index_post(instance)
+    if created:
+        UserStats.bump(instance.author_id, posts_count=1)
+        timeline.fan_out(instance)
+        trending.start(instance.pk, instance.group_id, instance.pub_date)
+        caching.invalidate(*post_scopes(instance))
+        caching.invalidate_followers(instance.author_id)
+        return
+    if update_fields is not None and "version" not in update_fields:
+        Post.objects.filter(pk=instance.pk).update(version=F("version") + 1)
+    instance.refresh_from_db(fields=["version"])
+    old_group_id = getattr(instance, "_saved_group_id", None)
+    if old_group_id != instance.group_id:
+        trending.move_to_group(instance.pk, instance.group_id)
+        caching.invalidate(*["group:%s" % pk
+                             for pk in (old_group_id, instance.group_id) if pk])
+    caching.forget_posts(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    UserStats.bump(instance.author_id, posts_count=-1)
+    caching.invalidate(*post_scopes(instance))
+    caching.invalidate_followers(instance.author_id)
+    caching.forget_posts(instance.pk)
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F("comment_count") + 1, version=F("version") + 1)
+        trending.record(instance.post_id, instance.post.group_id, "comment",
+                        instance.created)
+        caching.forget_posts(instance.post_id)
+    if not raw:
+        search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id).update(
+        comment_count=F("comment_count") - 1, version=F("version") + 1)
+    caching.forget_posts(instance.post_id)
+    search.remove_comment(instance.pk)
+
+
+def follow_scopes(follow):
+    # Счётчики подписок в профиле и на странице поста
+    return ["user:%s" % follow.user_id, "user:%s" % follow.author_id]
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.bump(instance.author_id, followers_count=1)
+        UserStats.bump(instance.user_id, following_count=1)
+        timeline.backfill(instance)
+        trending.record_follow(instance.author_id)
+        caching.invalidate("follow:%s" % instance.user_id,
+                           *follow_scopes(instance))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    UserStats.bump(instance.author_id, followers_count=-1)
+    UserStats.bump(instance.user_id, following_count=-1)
+    timeline.prune(instance)
+    timeline.schedule_cool_down(instance.author_id)
+    caching.invalidate("follow:%s" % instance.user_id,
+                       *follow_scopes(instance))
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        caching.invalidate("group:%s" % instance.pk)
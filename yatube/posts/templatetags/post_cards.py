@@ -0,0 +1,25 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import caching, thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Карточки постов (post_item.html) из кэша фрагментов.
+
+    Карточка с картинкой, у которой ещё нет всех вариантов, не
+    кэшируется: в ней пока ссылка на оригинал."""
+    user = context["user"]
+    card = context.template.engine.get_template("post_item.html")
+
+    def render(post):
+        return card.render(context.new({"post": post, "user": user}))
+
+    def cacheable(post):
+        return not post.image or thumbnails.variants_ready(post.image)
+
+    return mark_safe("".join(caching.cards(list(posts), user, render,
+                                           cacheable)))
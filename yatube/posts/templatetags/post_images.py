@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+from django import template
+from django.conf import settings
+
+from posts.thumbnails import enqueue, ready_variants
+
+register = template.Library()
+
+# Карточка поста занимает всю ширину колонки, но не шире 960px
+SIZES = "(max-width: 960px) 100vw, 960px"
+
+MIME_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg",
+              "PNG": "image/png"}
+
+
+@register.inclusion_tag("post_picture.html")
+def post_picture(image, lazy=True):
+    """<picture> с вариантами картинки поста разной ширины и формата.
+
+    Пока фоновый воркер не создал варианты, отдаётся оригинал."""
+    srcsets = OrderedDict()
+    for variant, thumbnail in ready_variants(image):
+        format_, width, geometry, options = variant
+        srcsets.setdefault(format_, [])
+        if thumbnail is not None:
+            srcsets[format_].append("%s %sw" % (thumbnail.url, width))
+        elif getattr(settings, "THUMBNAIL_DEFERRED", True):
+            enqueue(image.name, geometry, options)
+
+    fallback = srcsets.popitem()[1] if srcsets else []
+    sources = [{"type": MIME_TYPES.get(format_, ""),
+                "srcset": ", ".join(candidates)}
+               for format_, candidates in srcsets.items() if candidates]
+    return {
+        "sources": sources,
+        "src": fallback[-1].rsplit(" ", 1)[0] if fallback else image.url,
+        "srcset": ", ".join(fallback),
+        "sizes": SIZES,
+        "lazy": lazy,
+    }
@@ -0,0 +1,138 @@
+"""Бюджеты SQL-запросов для тестов: защита от N+1.
+
+    with QueryBudget(5):
+        client.get("/")
+
+    @QueryBudget(url_name="index")
+    def test_index(self): ...
+
+    response = assert_view_budget(self.client, "profile", "leo")
+
+Бюджет - верхняя граница числа запросов. Бюджеты страниц объявлены в
+QUERY_BUDGETS по именам из posts/urls.py и posts/api_urls.py (для
+каждого метода отдельно), чтобы правка шаблона или вьюхи, добавившая
+запросы, роняла тесты. При превышении в ошибке перечисляются все запросы
+и повторяющиеся «отпечатки» (SQL без конкретных значений параметров).
+
+Для pytest (pytest.ini рядом с manage.py) есть фикстура query_budget,
+она подключена в conftest.py.
+"""
+import re
+from collections import Counter
+from contextlib import ContextDecorator
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# Запросы при холодном кэше для вошедшего пользователя. Бюджеты
+# рассчитаны и на SESSION_BACKEND=db без кэша пользователя, где сессия и
+# пользователь - это уже два запроса
+QUERY_BUDGETS = {
+    "index": 3,
+    "group": 5,
+    "search": 4,
+    "trending": 4,
+    "group_trending": 5,
+    "follow_index": 4,
+    "profile": 6,
+    "post": 5,
+    "post_comments": 4,
+    "new_post": {"GET": 3, "POST": 15},
+    "post_edit": {"GET": 5, "POST": 11},
+    "add_comment": {"GET": 4, "POST": 10},
+    "profile_follow": 14,
+    "profile_unfollow": 10,
+    "api_posts": {"GET": 3, "POST": 15},
+    "api_post": {"GET": 3, "PATCH": 10},
+    "api_post_comments": {"GET": 4, "POST": 10},
+    "api_groups": 3,
+    "api_group_posts": 4,
+    "api_user": 4,
+    "api_user_posts": 4,
+    "api_user_follow": {"POST": 14, "DELETE": 10},
+    "api_follow_feed": 4,
+}
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r"\((?:\?, )+\?\)")
+
+
+def fingerprint(sql):
+    """SQL без значений: одинаковые запросы с разными id совпадают."""
+    return IN_LIST_RE.sub("(...)", LITERAL_RE.sub("?", sql))
+
+
+def budget_for(url_name, method="GET"):
+    budget = QUERY_BUDGETS[url_name]
+    if isinstance(budget, dict):
+        return budget[method.upper()]
+    return budget
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget(ContextDecorator):
+    def __init__(self, budget=None, url_name=None, method="GET",
+                 using="default"):
+        if budget is None:
+            budget = budget_for(url_name, method)
+        self.budget = budget
+        self.label = url_name or "блок"
+        self.using = using
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(self) > self.budget:
+            raise QueryBudgetExceeded(self.report())
+
+    def __len__(self):
+        return len(self.context.captured_queries)
+
+    @property
+    def queries(self):
+        return [query["sql"] for query in self.context.captured_queries]
+
+    def duplicates(self):
+        counts = Counter(fingerprint(sql) for sql in self.queries)
+        return [(sql, count) for sql, count in counts.most_common()
+                if count > 1]
+
+    def report(self):
+        lines = ["%s: %s запросов при бюджете %s" % (
+            self.label, len(self), self.budget)]
+        duplicates = self.duplicates()
+        if duplicates:
+            lines.append("Повторяющиеся запросы:")
+            lines += ["  %s× %s" % (count, sql) for sql, count in duplicates]
+        lines.append("Все запросы:")
+        lines += ["  %s. %s" % (number, sql)
+                  for number, sql in enumerate(self.queries, 1)]
+        return "\n".join(lines)
+
+
+def assert_view_budget(client, url_name, *args, method="get", data=None,
+                       **kwargs):
+    """Запрашивает страницу url_name и проверяет её бюджет из QUERY_BUDGETS."""
+    url = reverse(url_name, args=args, kwargs=kwargs or None)
+    with QueryBudget(url_name=url_name, method=method):
+        return getattr(client, method.lower())(url, data or {})
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def query_budget(db):
+        """Фабрика QueryBudget: with query_budget(url_name="index"): ..."""
+        return QueryBudget
@@ -1,14 +1,64 @@
-from django.core.cache import cache
-from django.core.cache.utils import make_template_fragment_key
-from django.test import TestCase, Client
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection
+from django.db.utils import ConnectionDoesNotExist
+from django.http import Http404, HttpResponse
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         Client, override_settings)
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.http import urlencode
 from django.contrib.auth import get_user_model
-from .models import Post, Group
+from PIL import Image
+from yatube import assets
+from yatube.cache import INVALIDATION_KEY, SEQUENCE_KEY, TieredCache
+from yatube.routers import PIN_KEY, ReplicaRouter, ReplicaRoutingMiddleware
+
+from . import api_urls, caching, search, thumbnails, timeline, trending, urls
+from .testing import QUERY_BUDGETS, QueryBudget, QueryBudgetExceeded, assert_view_budget
+from .models import (Post, Group, Comment, Follow, TimelineEntry,
+                     TrendingPost, UserStats)
 
 User = get_user_model()
 
 
+def image_upload(name="test.png", size=(10, 10), format_="PNG", **params):
+    buffer = BytesIO()
+    Image.new("RGB", size, "red").save(buffer, format_, **params)
+    return SimpleUploadedFile(name, buffer.getvalue(),
+                              content_type=Image.MIME[format_])
+
+
+def use_temporary_media(test):
+    """Загрузки и миниатюры теста - во временном MEDIA_ROOT."""
+    root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, root)
+    settings_override = override_settings(MEDIA_ROOT=root)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+
+
 class ProfileTest(TestCase):
     def setUp(self):
+        use_temporary_media(self)
         cache.clear()
         self.client = Client()
         self.user = User.objects.create_user(
@@ -52,9 +102,9 @@ class ProfileTest(TestCase):
 
     def test_post_with_image(self):
         self.client.login(username="user_test", password="12345")
-        with open('media/test.png', 'rb') as fp:
-            self.client.post(
-                "/new/", data={'text': 'new post', 'image': fp, 'group': self.group.pk})
+        self.client.post(
+            "/new/", data={'text': 'new post', 'image': image_upload(),
+                           'group': self.group.pk})
 
         response = self.client.get("")
         self.assertContains(response, '<img', status_code=200)
@@ -71,9 +121,9 @@ class ProfileTest(TestCase):
     def test_wrong_format_image(self):
         self.client.login(username="user_test", password="12345")
 
-        with open('media/test.txt', 'rb') as fp:
-            response = self.client.post(
-                "/new/", {'text': "123", 'image': fp})
+        response = self.client.post(
+            "/new/", {'text': "123",
+                      'image': SimpleUploadedFile("test.txt", b"")})
 
         self.assertFormError(response, 'form', "image",
                              'Отправленный файл пуст.')
@@ -82,10 +132,34 @@ class ProfileTest(TestCase):
         self.client.login(username="user_test", password="12345")
         self.client.post('/new/', data={'text': 'new_post'})
         response = self.client.get("")
-        key = make_template_fragment_key('index_page')
+        post = Post.objects.get(text='new_post')
+        key, = caching.card_keys([post], self.user)
         html_cache = cache.get(key)
         self.assertIn(html_cache, str(response.content.decode()))
 
+        # правка сбрасывает закэшированные пост и карточку
+        self.client.post(f'/user_test/{post.pk}/edit/', data={'text': 'changed'})
+        response = self.client.get("")
+        self.assertContains(response, text='changed')
+        self.assertNotContains(response, text='new_post')
+
+        self.client.post('/new/', data={'text': 'another_post'})
+        response = self.client.get("")
+        self.assertContains(response, text='another_post')
+
+    def test_cache_is_per_page_and_viewer(self):
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'post {i}') for i in range(15))
+        first = self.client.get("", {"page": 1}).context["page"]
+        second = self.client.get("", {"page": 2}).context["page"]
+        self.assertNotEqual([p.pk for p in first], [p.pk for p in second])
+
+        self.client.login(username="user_test", password="12345")
+        self.assertContains(self.client.get(""), 'Редактировать')
+        User.objects.create_user(username="user_2", password="12345")
+        self.client.login(username="user_2", password="12345")
+        self.assertNotContains(self.client.get(""), 'Редактировать')
+
     def test_auth_user_follow_unfollow(self):
         user = User.objects.create_user(username="user_2", password="12345")
         Post.objects.create(author=user, text='lalala')
@@ -124,3 +198,1205 @@ class ProfileTest(TestCase):
         self.client.logout()
         response = self.client.get("/user_2/1/comment/")
         self.assertRedirects(response, '/auth/login/?next=/user_2/1/comment/')
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f"post {i}") for i in range(25))
+        # половина постов с одинаковой датой, чтобы проверить порядок по id
+        first = Post.objects.order_by("pk")[:12]
+        Post.objects.filter(pk__in=list(first.values_list("pk", flat=True))).update(
+            pub_date=first[0].pub_date)
+        self.expected = list(
+            Post.objects.order_by("-pub_date", "-pk").values_list("pk", flat=True))
+
+    def walk(self, url):
+        seen = []
+        response = self.client.get(url)
+        while True:
+            page = response.context["page"]
+            seen.extend(post.pk for post in page)
+            if not page.has_next():
+                return seen, response
+            response = self.client.get(url, {"cursor": page.next_cursor})
+
+    def test_walk_forward_and_back(self):
+        seen, response = self.walk("/")
+        self.assertEqual(seen, self.expected)
+
+        page = response.context["page"]
+        response = self.client.get("/", {"cursor": page.previous_cursor})
+        self.assertEqual([post.pk for post in response.context["page"]],
+                         self.expected[10:20])
+
+    def test_no_count_query(self):
+        first = self.client.get("/").context["page"]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/", {"cursor": first.next_cursor})
+        self.assertFalse(
+            [q for q in queries.captured_queries if "COUNT(" in q["sql"]])
+
+    def test_page_number_fallback(self):
+        response = self.client.get("/", {"page": 2})
+        self.assertEqual([post.pk for post in response.context["page"]],
+                         self.expected[10:20])
+        self.assertContains(response, "?page=3")
+
+    def test_bad_cursor_returns_first_page(self):
+        response = self.client.get("/", {"cursor": "garbage"})
+        self.assertEqual([post.pk for post in response.context["page"]],
+                         self.expected[:10])
+
+
+class FeedQueryBudgetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.group = Group.objects.create(
+            title='test', slug='test', description='test group')
+        authors = [User.objects.create_user(username=f"author_{i}")
+                   for i in range(5)]
+        for author in authors:
+            Follow.objects.create(user=self.user, author=author)
+        for i in range(10):
+            post = Post.objects.create(
+                author=authors[i % 5], group=self.group, text=f"post {i}")
+            for _ in range(i):
+                Comment.objects.create(post=post, author=self.user, text="hi")
+        self.client.login(username="user_test", password="12345")
+
+    def assert_budget(self, url, budget):
+        with self.assertNumQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_index(self):
+        # пользователь, страница; сессия уже в кэше после входа
+        response = self.assert_budget("/", 2)
+        self.assertContains(response, "9 комментариев")
+        self.assertContains(response, "1 комментарий")
+
+    def test_index_from_cache(self):
+        self.client.get("/")
+        # сессия, пользователь, лента и посты - всё из кэша
+        self.assert_budget("/", 0)
+
+        post = Post.objects.get(text="post 0")
+        Comment.objects.create(post=post, author=self.user, text="hi")
+        # пост с новым комментарием перечитывается одним запросом
+        response = self.assert_budget("/", 1)
+        self.assertContains(response, "1 комментарий", count=2)
+
+    def test_group_posts(self):
+        # пользователь, группа, страница, id группы для ETag
+        self.assert_budget("/group/test/", 4)
+
+    def test_profile(self):
+        # пользователь, профиль со счётчиками, подписка, страница,
+        # id автора для ETag
+        self.assert_budget("/author_0/", 5)
+
+    def test_follow_index(self):
+        # пользователь, популярные авторы, страница ленты
+        self.assert_budget("/follow/", 3)
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.author = User.objects.create_user(
+            username="user_2", password="12345")
+        self.client.login(username="user_test", password="12345")
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_follow_unfollow(self):
+        self.client.get("/user_2/follow/")
+        self.client.get("/user_2/follow/")
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.user).following_count, 1)
+
+        response = self.client.get("/user_2/")
+        self.assertEqual(response.context["followers"], 1)
+
+        self.client.get("/user_2/unfollow/")
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.user).following_count, 0)
+
+    def test_posts_and_comments(self):
+        self.client.post("/new/", data={"text": "new_post"})
+        post = Post.objects.get(author=self.user)
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+
+        self.client.post(f"/user_test/{post.pk}/comment/", data={"text": "hi"})
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+        response = self.client.get(f"/user_test/{post.pk}/")
+        self.assertEqual(response.context["number_of_posts"], 1)
+
+        post.delete()
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+
+    def test_recount_repairs_drift(self):
+        post = Post.objects.create(author=self.author, text="text")
+        Comment.objects.create(post=post, author=self.user, text="hi")
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        UserStats.objects.filter(user=self.user).delete()
+        Post.objects.update(comment_count=0)
+
+        call_command("recount_stats", stdout=StringIO())
+
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+
+def test_query_budget_fixture(query_budget, client):
+    # Запускается только под pytest: фикстура из conftest.py
+    with query_budget(url_name="index"):
+        client.get("/")
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.author = User.objects.create_user(username="user_2")
+        self.star = User.objects.create_user(username="user_3")
+        self.client.login(username="user_test", password="12345")
+
+    def feed(self, **params):
+        response = self.client.get("/follow/", params)
+        return [post.text for post in response.context["page"]], response
+
+    def test_fan_out_backfill_and_prune(self):
+        Post.objects.create(author=self.author, text="old")
+        self.client.get("/user_2/follow/")
+        Post.objects.create(author=self.author, text="new")
+
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.feed()[0], ["new", "old"])
+
+        self.client.get("/user_2/unfollow/")
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        self.assertEqual(self.feed()[0], [])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_hot_author_is_merged_on_read(self):
+        self.client.get("/user_2/follow/")
+        self.client.get("/user_3/follow/")
+        for i in range(4):
+            Post.objects.create(author=self.author, text=f"author {i}")
+            Post.objects.create(author=self.star, text=f"star {i}")
+
+        self.assertFalse(TimelineEntry.objects.filter(author=self.star).exists())
+        expected = list(Post.objects.order_by("-pub_date", "-pk")
+                        .values_list("text", flat=True))
+
+        seen, response = self.feed()
+        while response.context["page"].has_next():
+            texts, response = self.feed(
+                cursor=response.context["page"].next_cursor)
+            seen.extend(texts)
+        self.assertEqual(seen, expected)
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=3, TIMELINE_BATCH_SIZE=1)
+    def test_author_cooling_down_keeps_posts(self):
+        fans = [User.objects.create_user(username=f"fan{i}") for i in range(2)]
+        self.client.get("/user_3/follow/")
+        for fan in fans:
+            Follow.objects.create(user=fan, author=self.star)
+        for i in range(3):
+            Post.objects.create(author=self.star, text=f"hot era {i}")
+        self.assertFalse(TimelineEntry.objects.filter(author=self.star).exists())
+
+        # Отписка на пороге ничего не раскладывает сама: раскладка уходит
+        # в фоновый поток после COMMIT (в TestCase его нет)
+        with mock.patch("posts.timeline.executor") as executor:
+            with CaptureQueriesContext(connection) as queries:
+                Follow.objects.filter(user=fans[0]).delete()
+        executor.assert_not_called()
+        self.assertLessEqual(len(queries), 6)
+        self.assertFalse(TimelineEntry.objects.filter(author=self.star).exists())
+
+        timeline.cool_down(self.star.pk)
+        self.assertEqual(TimelineEntry.objects.filter(author=self.star).count(), 6)
+        self.assertEqual(self.feed()[0][0], "hot era 2")
+
+
+class FeedIndexesTest(TestCase):
+    def test_unique_follow(self):
+        user = User.objects.create_user(username="user_test")
+        author = User.objects.create_user(username="user_2")
+        Follow.objects.create(user=user, author=author)
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=user, author=author)
+
+    def test_explain_feeds_uses_indexes(self):
+        out = StringIO()
+        call_command("explain_feeds", seed=200, repeat=1,
+                     skip_baseline=True, stdout=out)
+        if connection.vendor == "sqlite":
+            self.assertIn("post_group_date_idx", out.getvalue())
+            self.assertIn("comment_post_created_idx", out.getvalue())
+
+
+class ExplainBaselineTest(TransactionTestCase):
+    @skipUnless(connection.vendor == "sqlite", "замер «до» только на SQLite")
+    def test_baseline_leaves_indexes_in_place(self):
+        out = StringIO()
+        call_command("explain_feeds", seed=100, repeat=1, stdout=out)
+        self.assertIn("До: без индексов", out.getvalue())
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Post._meta.db_table)
+        self.assertIn("post_group_date_idx", constraints)
+        user, author = User.objects.all()[:2]
+        Follow.objects.get_or_create(user=user, author=author)
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=user, author=author)
+
+
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        self.shared = caches["shared"]
+        self.shared.clear()
+        options = {"SHARED": "shared", "LOCAL_MAX_ENTRIES": 3,
+                   "SYNC_INTERVAL": 0}
+        # два «процесса» с собственным L1 и общим L2
+        self.first = TieredCache(None, {"OPTIONS": options})
+        self.second = TieredCache(None, {"OPTIONS": options})
+
+    def test_reads_through_and_fills_local(self):
+        self.first.set("key", "value")
+        self.assertEqual(self.second.get("key"), "value")
+        self.shared.set("key", "changed")
+        self.assertEqual(self.second.get("key"), "value")
+
+    def test_delete_invalidates_other_processes(self):
+        self.first.set("key", "value")
+        self.second.get("key")
+        self.first.delete("key")
+        self.assertIsNone(self.second.get("key"))
+
+    def test_delete_keeps_other_local_entries(self):
+        self.first.set_many({"key": "value", "other": "kept"})
+        self.second.get_many(["key", "other"])
+        self.shared.set("other", "changed")
+        self.first.delete("key")
+        self.assertIsNone(self.second.get("key"))
+        # Остальные ключи L1 второго процесса пережили инвалидацию
+        self.assertEqual(self.second.get("other"), "kept")
+
+    def test_lost_invalidations_flush_local(self):
+        self.first.set("key", "value")
+        self.second.get("key")
+        self.first.delete("other")
+        self.shared.delete(INVALIDATION_KEY % self.shared.get(SEQUENCE_KEY))
+        self.shared.set("key", "changed")
+        self.assertEqual(self.second.get("key"), "changed")
+
+    def test_clear_flushes_every_process(self):
+        self.first.set("key", "value")
+        self.second.get("key")
+        self.first.clear()
+        self.assertIsNone(self.second.get("key"))
+
+    def test_local_tier_is_bounded(self):
+        self.first.set_many({f"key{i}": i for i in range(5)})
+        self.assertEqual(len(self.first.local), 3)
+        self.assertEqual(self.first.get_many(["key0", "key4"]),
+                         {"key0": 0, "key4": 4})
+
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        use_temporary_media(self)
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.client.login(username="user_test", password="12345")
+
+    def test_thumbnail_is_generated_off_request(self):
+        with mock.patch("posts.thumbnails.executor") as executor:
+            self.client.post("/new/", data={'text': 'new post',
+                                            'image': image_upload()})
+        # задача ставится только после COMMIT, в TestCase его нет
+        executor.assert_not_called()
+
+        post = Post.objects.get(text='new post')
+        response = self.client.get("/")
+        self.assertContains(response, f'src="{post.image.url}"')
+        post_url = f"/user_test/{post.pk}/"
+        etag = self.client.get(post_url)["ETag"]
+
+        for _, _, geometry, options in thumbnails.post_variants():
+            thumbnails.generate(post.image.name, geometry, options)
+        # Готовые миниатюры меняют ETag: 304 со старой разметкой не придёт
+        response = self.client.get(post_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, f'src="{post.image.url}"')
+        response = self.client.get("/")
+        self.assertNotContains(response, f'src="{post.image.url}"')
+        self.assertContains(response, '<img class="card-img" src="/media/cache/')
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, '.webp 320w')
+        self.assertContains(response, '.jpg 960w')
+
+    def test_variants_are_looked_up_once(self):
+        Post.objects.create(author=self.user, text="picture",
+                            image=image_upload())
+        with mock.patch("posts.thumbnails.executor"):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get("/")
+        lookups = [query for query in queries.captured_queries
+                   if "thumbnail_kvstore" in query["sql"]]
+        self.assertEqual(len(lookups), 1)
+
+
+class UploadTest(TestCase):
+    def setUp(self):
+        use_temporary_media(self)
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.client.login(username="user_test", password="12345")
+
+    def jpeg(self, size):
+        exif = Image.Exif()
+        exif[0x0110] = "Secret Camera"
+        return image_upload("photo.jpeg", size, "JPEG", exif=exif)
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_image_is_resized_without_exif(self):
+        self.client.post("/new/", {'text': 'photo', 'image': self.jpeg((400, 200))})
+        post = Post.objects.get(text='photo')
+        self.assertTrue(post.image.name.endswith(".jpg"))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 50))
+            self.assertNotIn("exif", image.info)
+
+    @override_settings(POST_IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_oversized_upload_is_rejected(self):
+        response = self.client.post(
+            "/new/", {'text': 'big', 'image': self.jpeg((400, 200))})
+        self.assertFormError(response, 'form', 'image',
+                             'Файл слишком большой, максимум 100\xa0байт.')
+        self.assertFalse(Post.objects.filter(text='big').exists())
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=1000)
+    def test_pixel_limit_is_checked_before_decoding(self):
+        upload = self.jpeg((400, 200))
+        with mock.patch.object(Image.Image, "load") as load:
+            response = self.client.post(
+                "/new/", {'text': 'bomb', 'image': upload})
+        load.assert_not_called()
+        self.assertFormError(response, 'form', 'image',
+                             'Картинка слишком большая: 400×200.')
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="reader")
+        self.post = Post.objects.create(text="Ловля щуки весной", author=self.user)
+        self.other = Post.objects.create(text="Про карасей", author=self.user)
+        Comment.objects.create(post=self.other, author=self.user,
+                               text="А щуки тут нет")
+
+    def assertFinds(self, query, posts):
+        response = self.client.get("/search/", {"q": query})
+        self.assertEqual(list(response.context["page"]), posts)
+
+    def check_backend(self):
+        # совпадение в тексте поста важнее совпадения в комментарии
+        self.assertFinds("щуки", [self.post, self.other])
+        self.assertFinds("ЩУКИ весной", [self.post])
+        self.assertFinds('" OR *', [])
+
+        self.post.text = "Ловля окуня"
+        self.post.save()
+        self.assertFinds("щуки", [self.other])
+        self.other.comments.all().delete()
+        self.assertFinds("щуки", [])
+        self.other.delete()
+        self.assertFinds("карасей", [])
+
+    @skipUnless(connection.vendor == "sqlite", "FTS5 есть только в SQLite")
+    def test_fts5_backend(self):
+        self.assertIsInstance(search.backend(), search.Fts5Backend)
+        self.check_backend()
+
+    @override_settings(POSTS_SEARCH_BACKEND="index")
+    def test_index_backend(self):
+        search.backend().rebuild()
+        self.check_backend()
+
+    def test_results_are_paginated(self):
+        for i in range(12):
+            Post.objects.create(text="щуки %s" % i, author=self.user)
+        response = self.client.get("/search/", {"q": "щуки", "page": 2})
+        self.assertEqual(response.context["paginator"].count, 14)
+        self.assertEqual(len(response.context["page"]), 4)
+        self.assertContains(response, "?q=%D1%89%D1%83%D0%BA%D0%B8&amp;page=1")
+
+
+class BenchmarkTest(TestCase):
+    def test_seed_and_bench_views(self):
+        call_command("seed", users=30, groups=2, posts=200, comments=100,
+                     follows=300, stdout=StringIO())
+        followers = sorted(UserStats.objects.values_list(
+            "followers_count", flat=True), reverse=True)
+        # степенной закон: у самого популярного автора подписчиков
+        # намного больше, чем у типичного
+        self.assertGreater(followers[0], 3 * followers[len(followers) // 2])
+
+        out = StringIO()
+        call_command("bench_views", requests=2, stdout=out)
+        for name in ("index", "group_posts", "profile", "post_view",
+                     "follow_index"):
+            self.assertIn(name, out.getvalue())
+
+        with self.assertRaisesMessage(CommandError, "Превышены пороги"):
+            call_command("bench_views", requests=1, cold=True,
+                         max_queries=0, stdout=StringIO())
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE=1, INSTRUMENTATION_HEADERS=True)
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="author")
+        for i in range(3):
+            Post.objects.create(text="post %s" % i, author=self.user)
+
+    def test_metrics_are_logged_and_exposed(self):
+        with self.assertLogs("yatube.requests", "INFO") as logs:
+            response = self.client.get("/author/")
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["view"], "profile")
+        self.assertEqual(record["status"], 200)
+        self.assertGreater(record["queries"], 0)
+        self.assertGreater(record["template_ms"], 0)
+        self.assertGreater(record["cache_misses"], 0)
+        self.assertIn('db;dur=', response["Server-Timing"])
+        self.assertIn('SQL x%s' % record["queries"], response["Server-Timing"])
+
+        with self.assertLogs("yatube.requests", "INFO") as logs:
+            self.client.get("/author/")
+        record = json.loads(logs.records[0].getMessage())
+        self.assertGreater(record["cache_hits"], 0)
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get("/author/")
+        self.assertNotIn("Server-Timing", response)
+
+
+class ViewQueryBudgetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.group = Group.objects.create(
+            title='test', slug='test', description='test group')
+        self.authors = [User.objects.create_user(username=f"author_{i}")
+                        for i in range(5)]
+        for author in self.authors[:4]:
+            Follow.objects.create(user=self.user, author=author)
+        for i in range(10):
+            post = Post.objects.create(
+                author=self.authors[i % 5], group=self.group, text=f"post {i}")
+            for _ in range(i):
+                Comment.objects.create(post=post, author=self.user, text="hi")
+        self.post = Post.objects.create(author=self.user, text="own post")
+        self.client.login(username="user_test", password="12345")
+
+    def test_every_view_has_a_budget(self):
+        names = {pattern.name for pattern
+                 in urls.urlpatterns + api_urls.urlpatterns}
+        self.assertEqual(names - set(QUERY_BUDGETS), set())
+
+    def test_feeds(self):
+        assert_view_budget(self.client, "index")
+        assert_view_budget(self.client, "group", "test")
+        assert_view_budget(self.client, "follow_index")
+        assert_view_budget(self.client, "profile", "author_0")
+        assert_view_budget(self.client, "search", data={"q": "post"})
+        assert_view_budget(self.client, "trending")
+        assert_view_budget(self.client, "group_trending", "test")
+
+    def test_post_pages(self):
+        post = Post.objects.get(text="post 9")
+        assert_view_budget(self.client, "post", "author_4", post.pk)
+        assert_view_budget(self.client, "post_comments", "author_4", post.pk)
+        assert_view_budget(self.client, "new_post")
+        assert_view_budget(self.client, "post_edit", "user_test", self.post.pk)
+        assert_view_budget(self.client, "add_comment", "author_4", post.pk)
+
+    def test_writes(self):
+        assert_view_budget(self.client, "new_post", method="post",
+                           data={"text": "new", "group": self.group.pk})
+        assert_view_budget(self.client, "post_edit", "user_test", self.post.pk,
+                           method="post", data={"text": "edited"})
+        assert_view_budget(self.client, "add_comment", "user_test", self.post.pk,
+                           method="post", data={"text": "comment"})
+        assert_view_budget(self.client, "profile_follow", "author_4")
+        assert_view_budget(self.client, "profile_unfollow", "author_4")
+
+    def test_api(self):
+        post = Post.objects.get(text="post 9")
+        assert_view_budget(self.client, "api_posts")
+        assert_view_budget(self.client, "api_post", post.pk)
+        assert_view_budget(self.client, "api_post_comments", post.pk)
+        assert_view_budget(self.client, "api_groups")
+        assert_view_budget(self.client, "api_group_posts", "test")
+        assert_view_budget(self.client, "api_user", "author_0")
+        assert_view_budget(self.client, "api_user_posts", "author_0")
+        assert_view_budget(self.client, "api_follow_feed")
+        assert_view_budget(self.client, "api_posts", method="post",
+                           data={"text": "new", "group": self.group.pk})
+        assert_view_budget(self.client, "api_post_comments", post.pk,
+                           method="post", data={"text": "comment"})
+        assert_view_budget(self.client, "api_user_follow", "author_4",
+                           method="post")
+        assert_view_budget(self.client, "api_user_follow", "author_4",
+                           method="delete")
+
+    def test_report_lists_duplicates(self):
+        with self.assertRaises(QueryBudgetExceeded) as error:
+            with QueryBudget(1):
+                for author in self.authors[:3]:
+                    list(author.author_posts.all())
+        report = str(error.exception)
+        self.assertIn("3 запросов при бюджете 1", report)
+        self.assertIn('3× SELECT', report)
+        self.assertIn('"author_id" = ?', report)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="author")
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def request(self, path, method="get", data=None, session=None,
+                action=None):
+        request = getattr(self.factory, method)(path, data or {})
+        request.session = session if session is not None else {}
+        request.resolver_match = resolve(path)
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Post))
+            if method == "post":
+                Post.objects.create(text="new", author=self.user)
+            if action is not None:
+                action()
+            return HttpResponse()
+
+        def handler(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaRoutingMiddleware(handler)
+        middleware(request)
+        return seen[0], request.session
+
+    def test_feeds_read_from_replica(self):
+        self.assertEqual(self.request("/")[0], "replica")
+        self.assertEqual(self.request("/author/")[0], "replica")
+        self.assertEqual(self.request("/new/")[0], "default")
+        # вне запроса (сигналы, команды, фоновые потоки) - всегда default
+        self.assertEqual(self.router.db_for_read(Post), "default")
+
+    def test_writer_is_pinned_to_primary(self):
+        alias, session = self.request("/new/", method="post")
+        self.assertEqual(alias, "default")
+        self.assertEqual(self.request("/", session=session)[0], "default")
+        self.assertEqual(self.request("/")[0], "replica")
+
+        with mock.patch("yatube.routers.time.time", return_value=time.time() + 60):
+            self.assertEqual(self.request("/", session=session)[0], "replica")
+
+    def test_lookup_without_write_does_not_pin(self):
+        UserStats.rebuild(self.user.pk)
+        _, session = self.request(
+            "/author/",
+            action=lambda: UserStats.objects.get_or_create(user=self.user))
+        self.assertNotIn(PIN_KEY, session)
+        _, session = self.request(
+            "/author/", action=lambda: UserStats.bump(self.user.pk,
+                                                      posts_count=1))
+        self.assertIn(PIN_KEY, session)
+
+    def test_stats_rebuild_counts_on_primary(self):
+        Post.objects.create(text="one", author=self.user)
+        UserStats.objects.filter(user=self.user).delete()
+        # Алиаса "replica" нет в DATABASES: чтение с него упало бы
+        self.request("/author/", action=lambda: self.assertEqual(
+            UserStats.rebuild(self.user.pk).posts_count, 1))
+        with self.assertRaises(ConnectionDoesNotExist):
+            self.request("/author/", action=lambda: Post.objects.count())
+
+
+class DatabaseSettingsTest(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA %s" % name)
+            return cursor.fetchone()[0]
+
+    @skipUnless(connection.vendor == "sqlite", "настройки SQLite")
+    def test_sqlite_is_tuned(self):
+        self.assertEqual(self.pragma("synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma("temp_store"), 2)  # MEMORY
+        self.assertEqual(self.pragma("busy_timeout"), 20000)
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.author = User.objects.create_user(username="author")
+        self.group = Group.objects.create(
+            title='test', slug='test', description='test group')
+        for i in range(12):
+            Post.objects.create(author=self.author, group=self.group,
+                                text=f"post {i}")
+        self.post = Post.objects.create(author=self.user, text="own post")
+
+    def login(self):
+        self.client.login(username="user_test", password="12345")
+
+    def send(self, method, url, data):
+        return getattr(self.client, method)(
+            url, json.dumps(data), content_type="application/json")
+
+    def test_feed_pages_with_sparse_fields(self):
+        response = self.client.get(
+            "/api/v1/groups/test/posts/", {"fields": "id,text", "limit": 5})
+        data = response.json()
+        self.assertEqual(len(data["results"]), 5)
+        self.assertEqual(set(data["results"][0]), {"id", "text"})
+        self.assertEqual(data["results"][0]["text"], "post 11")
+        self.assertIsNone(data["previous"])
+
+        data = self.client.get(data["next"]).json()
+        self.assertEqual(data["results"][0], {
+            "id": Post.objects.get(text="post 6").pk, "text": "post 6"})
+        self.assertIn("fields=id%2Ctext", data["previous"])
+
+        response = self.client.get("/api/v1/posts/", {"fields": "id,secret"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get_and_gzip(self):
+        url = "/api/v1/posts/%s/" % self.post.pk
+        response = self.client.get(url)
+        self.assertEqual(response.json()["author"]["username"], "user_test")
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        Post.objects.filter(pk=self.post.pk).update(text="changed")
+        caching.forget_posts(self.post.pk)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        response = self.client.get("/api/v1/posts/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))[
+            "results"]), 10)
+
+    def test_writes_use_form_validation(self):
+        response = self.send("post", "/api/v1/posts/", {"text": "x"})
+        self.assertEqual(response.status_code, 401)
+
+        self.login()
+        response = self.send("post", "/api/v1/posts/", {"text": ""})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("text", response.json()["errors"])
+
+        response = self.send("post", "/api/v1/posts/",
+                             {"text": "from app", "group": self.group.pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["group"]["slug"], "test")
+        self.assertEqual(self.client.get("/api/v1/posts/").json()[
+            "results"][0]["text"], "from app")
+
+        url = "/api/v1/posts/%s/" % self.post.pk
+        response = self.send("patch", url, {"text": "edited"})
+        self.assertEqual(response.json()["text"], "edited")
+        other = Post.objects.filter(author=self.author).first()
+        response = self.send("patch", "/api/v1/posts/%s/" % other.pk,
+                             {"text": "mine"})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.delete(url).status_code, 405)
+
+    def test_patch_with_form_body(self):
+        self.login()
+        url = "/api/v1/posts/%s/" % self.post.pk
+        response = self.client.patch(
+            url, urlencode({"text": "from form"}),
+            content_type="application/x-www-form-urlencoded")
+        self.assertEqual(response.json()["text"], "from form")
+
+        response = self.client.patch(
+            url, encode_multipart(BOUNDARY, {"text": "from multipart"}),
+            content_type=MULTIPART_CONTENT)
+        self.assertEqual(response.json()["text"], "from multipart")
+
+        response = self.client.patch(url, "text", content_type="text/plain")
+        self.assertEqual(response.status_code, 415)
+
+    def test_comments_and_follow(self):
+        self.login()
+        url = "/api/v1/posts/%s/comments/" % self.post.pk
+        for i in range(3):
+            self.assertEqual(
+                self.send("post", url, {"text": f"comment {i}"}).status_code, 201)
+        data = self.client.get(url, {"limit": 2}).json()
+        self.assertEqual([c["text"] for c in data["results"]],
+                         ["comment 0", "comment 1"])
+        data = self.client.get(data["next"]).json()
+        self.assertEqual([c["text"] for c in data["results"]], ["comment 2"])
+
+        response = self.client.post("/api/v1/users/author/follow/")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(self.client.get("/api/v1/users/author/").json()["following"])
+        data = self.client.get("/api/v1/feed/", {"fields": "text"}).json()
+        self.assertEqual(data["results"][0], {"text": "post 11"})
+        self.assertEqual(
+            self.client.delete("/api/v1/users/author/follow/").json(),
+            {"following": False})
+        self.assertEqual(self.client.get("/api/v1/feed/").json()["results"], [])
+        self.assertEqual(self.client.get("/api/v1/users/nobody/").status_code, 404)
+
+
+class HttpCachingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.author = User.objects.create_user(username="author")
+        self.group = Group.objects.create(
+            title='test', slug='test', description='test group')
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text="first")
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def etag(self, url):
+        # ETag ленты считается до рендеринга, по скелету из кэша: первый
+        # запрос только кладёт скелет
+        self.client.get(url)
+        return self.client.get(url)["ETag"]
+
+    def test_anonymous_feed_is_public_and_answers_304(self):
+        response = self.client.get("/")
+        self.assertNotIn("ETag", response)
+        response = self.client.get("/")
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("s-maxage=30", response["Cache-Control"])
+        self.assertIn("Cookie", response["Vary"])
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        Comment.objects.create(post=self.post, author=self.user, text="hi")
+        self.assertEqual(self.revalidate("/", etag), 200)
+        etag = self.etag("/")
+        Post.objects.create(author=self.author, text="second")
+        self.assertEqual(self.revalidate("/", etag), 200)
+
+    def test_author_and_group_renames_change_etag(self):
+        url = "/author/%s/" % self.post.pk
+        etags = {"/": self.etag("/"), url: self.etag(url)}
+        self.group.title = "renamed"
+        self.group.save()
+        for page, etag in etags.items():
+            self.assertEqual(self.revalidate(page, etag), 200)
+        self.assertContains(self.client.get("/"), "renamed")
+
+        etag = self.etag("/")
+        self.author.username = "writer"
+        self.author.save()
+        self.assertEqual(self.revalidate("/", etag), 200)
+        self.assertContains(self.client.get("/"), "@writer")
+
+    def test_logged_in_pages_are_private(self):
+        anonymous = self.etag("/group/test/")
+        self.client.login(username="user_test", password="12345")
+        response = self.client.get("/group/test/")
+        self.assertIn("private", response["Cache-Control"])
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertNotEqual(response["ETag"], anonymous)
+        self.assertEqual(self.revalidate("/group/test/", response["ETag"]), 304)
+
+        etag = self.etag("/follow/")
+        self.assertEqual(self.revalidate("/follow/", etag), 304)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.revalidate("/follow/", etag), 200)
+
+    def test_profile_and_post_track_counters(self):
+        etag = self.etag("/author/")
+        self.assertEqual(self.revalidate("/author/", etag), 304)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.revalidate("/author/", etag), 200)
+
+        url = "/author/%s/" % self.post.pk
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.revalidate(url, etag), 304)
+        Comment.objects.create(post=self.post, author=self.user, text="hi")
+        self.assertEqual(self.revalidate(url, etag), 200)
+        self.assertNotIn("ETag", self.client.get("/user_test/%s/" % self.post.pk))
+
+
+@override_settings(POST_COMMENTS_PER_PAGE=3)
+class CommentPagesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="user_test")
+        self.post = Post.objects.create(author=self.user, text="viral")
+        for i in range(7):
+            Comment.objects.create(
+                post=self.post, author=self.user, text=f"comment {i}")
+        self.url = "/user_test/%s/" % self.post.pk
+
+    def test_post_renders_first_page_only(self):
+        response = self.client.get(self.url)
+        self.assertEqual([c.text for c in response.context["items"]],
+                         ["comment 0", "comment 1", "comment 2"])
+        self.assertNotContains(response, "comment 3")
+        self.assertContains(response, "js-more-comments")
+
+    def test_fragments_load_next_pages(self):
+        page = self.client.get(self.url).context["items"]
+        texts = []
+        while page.has_next():
+            cursor = page.next_cursor
+            response = self.client.get(
+                self.url + "comments/", {"cursor": cursor})
+            self.assertNotContains(response, "<html")
+            page = response.context["items"]
+            texts += [comment.text for comment in page]
+        self.assertEqual(texts, ["comment %s" % i for i in range(3, 7)])
+
+        Comment.objects.create(post=self.post, author=self.user, text="late")
+        response = self.client.get(self.url + "comments/", {"cursor": cursor})
+        self.assertContains(response, "late")
+        self.assertEqual(
+            self.client.get("/nobody/%s/comments/" % self.post.pk).status_code,
+            404)
+
+    def test_page_assets_exist(self):
+        response = self.client.get(self.url)
+        assets_used = re.findall(
+            r'(?:href|src)="%s([^"]+)"' % re.escape(settings.STATIC_URL),
+            response.content.decode())
+        self.assertIn("bootstrap/dist/css/bootstrap.min.css", assets_used)
+        for path in assets_used:
+            self.assertIsNotNone(finders.find(path), path)
+        # Подгрузка комментариев не зависит от jQuery
+        self.assertNotContains(response, "$(")
+
+
+class CardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="user_test", password="12345")
+        self.other = User.objects.create_user(username="other")
+        self.post = Post.objects.create(author=self.user, text="first")
+        Post.objects.create(author=self.other, text="second")
+
+    def test_cards_are_rendered_once(self):
+        response = self.client.get("/")
+        self.assertTemplateUsed(response, "post_item.html")
+        response = self.client.get("/")
+        self.assertTemplateNotUsed(response, "post_item.html")
+        self.assertContains(response, "first")
+        self.assertTemplateNotUsed(self.client.get("/user_test/"),
+                                   "post_item.html")
+
+    def test_edit_and_comment_bump_version(self):
+        self.client.get("/")
+        self.post.text = "edited"
+        self.post.save()
+        Comment.objects.create(post=self.post, author=self.other, text="hi")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 2)
+        response = self.client.get("/")
+        self.assertContains(response, "edited")
+        self.assertContains(response, "1 комментарий")
+
+    def test_login_keeps_cached_cards(self):
+        self.client.login(username="user_test", password="12345")
+        self.client.get("/")
+        self.client.logout()
+        self.client.login(username="user_test", password="12345")
+        response = self.client.get("/")
+        self.assertTemplateNotUsed(response, "post_item.html")
+
+    def test_repeated_saves_keep_version_in_sync(self):
+        self.post.text = "edited"
+        self.post.save()
+        self.post.text = "edited again"
+        self.post.save()
+        self.assertEqual(self.post.version, 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 2)
+        self.assertContains(self.client.get("/"), "edited again")
+
+    def test_author_and_group_renames_refresh_cards(self):
+        group = Group.objects.create(title="cats", slug="cats", description="")
+        self.post.group = group
+        self.post.save()
+        self.client.get("/")
+        group.title = "dogs"
+        group.save()
+        self.user.username = "renamed"
+        self.user.save()
+        response = self.client.get("/")
+        self.assertContains(response, "dogs")
+        self.assertContains(response, "@renamed")
+
+    def test_author_gets_own_variant(self):
+        self.assertNotContains(self.client.get("/"), "Редактировать")
+        self.client.login(username="user_test", password="12345")
+        self.assertContains(self.client.get("/"), "Редактировать", count=1)
+
+
+class StaticAssetsTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(STATIC_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command("build_assets", stdout=StringIO())
+        self.factory = RequestFactory()
+
+    def get(self, path, **headers):
+        return assets.serve(self.factory.get("/static/" + path, **headers), path)
+
+    def test_hashed_files_are_precompressed_and_immutable(self):
+        hashed = staticfiles_storage.stored_name(
+            "bootstrap/dist/css/bootstrap.min.css")
+        self.assertRegex(hashed, r"bootstrap\.min\.[0-9a-f]{12}\.css$")
+        response = self.get(hashed, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("Accept-Encoding", response["Vary"])
+        body = gzip.decompress(b"".join(response.streaming_content))
+        self.assertIn(b"Bootstrap v4.3.1", body)
+        with open(os.path.join(self.root, hashed), "rb") as original:
+            self.assertEqual(body, original.read())
+
+        response = self.get(hashed, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertNotIn("Content-Encoding", response)
+        etag = response["ETag"]
+        self.assertEqual(self.get(hashed, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    @skipUnless(assets.brotli, "нужен пакет brotli")
+    def test_brotli_is_preferred(self):
+        hashed = staticfiles_storage.stored_name(
+            "bootstrap/dist/css/bootstrap.min.css")
+        response = self.get(hashed, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        with open(os.path.join(self.root, hashed), "rb") as original:
+            self.assertEqual(
+                assets.brotli.decompress(b"".join(response.streaming_content)),
+                original.read())
+
+    @skipUnless(assets.rcssmin and assets.rjsmin, "нужны rcssmin и rjsmin")
+    def test_sources_are_minified(self):
+        storage = assets.CompressedManifestStaticFilesStorage(
+            location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        css = storage._save("site.css", ContentFile(b"a  {\n  color: red;\n}\n"))
+        js = storage._save("site.js", ContentFile(b"var  a = 1;  // comment\n"))
+        latin = storage._save("latin.css", ContentFile("/* é */".encode("latin-1")))
+        with storage.open(css) as saved:
+            self.assertEqual(saved.read(), b"a{color:red}")
+        with storage.open(js) as saved:
+            self.assertEqual(saved.read(), b"var a=1;")
+        with storage.open(latin) as saved:
+            self.assertEqual(saved.read(), "/* é */".encode("latin-1"))
+
+    def test_library_sources_are_not_collected(self):
+        self.assertFalse(os.path.exists(os.path.join(self.root, "jquery", "src")))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "bootstrap", "scss")))
+
+    def test_unhashed_and_missing_files(self):
+        response = self.get("bootstrap/dist/css/bootstrap.min.css")
+        self.assertEqual(response["Cache-Control"], "public, no-cache")
+        with self.assertRaises(Http404):
+            self.get("../settings.py")
+        with self.assertRaises(Http404):
+            self.get("jquery/missing.js")
+        self.assertEqual(staticfiles_storage.stored_name("missing.css"),
+                         "missing.css")
+
+
+class AdminTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="12345")
+        self.author = User.objects.create_user(username="author")
+        group = Group.objects.create(title="cats", slug="cats", description="")
+        for i in range(5):
+            Post.objects.create(author=self.author, group=group,
+                                text=f"ordinary post {i}")
+        self.post = Post.objects.create(author=self.author, text="rare zebra")
+        Comment.objects.create(post=self.post, author=self.admin,
+                               text="zebra comment")
+        Follow.objects.create(user=self.admin, author=self.author)
+        self.client.force_login(self.admin)
+
+    def changelist(self, model, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/admin/posts/%s/" % model, params)
+        self.assertEqual(response.status_code, 200)
+        return response, [query["sql"] for query in context.captured_queries]
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=3)
+    def test_large_tables_use_estimated_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        response, queries = self.changelist("post")
+        self.assertEqual(response.context["cl"].result_count, 6)
+        self.assertFalse([sql for sql in queries if "COUNT(" in sql])
+        # Авторы и группы - JOIN, а не запрос на строку
+        self.assertEqual(len([sql for sql in queries
+                              if sql.startswith('SELECT "posts_post"')]), 1)
+
+        _, queries = self.changelist("post", group__id__exact=1)
+        self.assertTrue([sql for sql in queries if "COUNT(" in sql])
+
+    def test_search_uses_indexes(self):
+        response, queries = self.changelist("post", q="zebra")
+        self.assertEqual(list(response.context["cl"].result_list), [self.post])
+        self.assertFalse([sql for sql in queries if " LIKE " in sql])
+
+        response, _ = self.changelist("comment", q="zebra")
+        self.assertEqual(len(response.context["cl"].result_list), 1)
+        response, _ = self.changelist("follow", q="author")
+        self.assertEqual(len(response.context["cl"].result_list), 1)
+        response, _ = self.changelist("follow", q="auth")
+        self.assertEqual(len(response.context["cl"].result_list), 0)
+
+        with override_settings(POSTS_SEARCH_BACKEND="index"):
+            search.backend().rebuild()
+            response, _ = self.changelist("post", q="Zebra rare")
+            self.assertEqual(list(response.context["cl"].result_list),
+                             [self.post])
+            response, _ = self.changelist("comment", q="zebra")
+            self.assertEqual(len(response.context["cl"].result_list), 1)
+
+    def test_foreign_keys_do_not_load_every_row(self):
+        response = self.client.get("/admin/posts/post/%s/change/" % self.post.pk)
+        self.assertNotContains(response, '<option value="%s"' % self.author.pk)
+        self.assertContains(response, "vForeignKeyRawIdAdminField")
+
+
+class TrendingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="author")
+        self.reader = User.objects.create_user(username="reader")
+        self.group = Group.objects.create(title="cats", slug="cats",
+                                          description="")
+        self.quiet = Post.objects.create(author=self.author, text="quiet")
+        self.busy = Post.objects.create(author=self.author, group=self.group,
+                                        text="busy")
+
+    def ranking(self, url="/trending/"):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [post.text for post in response.context["page"]]
+
+    def test_comments_raise_post(self):
+        self.assertEqual(self.ranking(), ["busy", "quiet"])
+        Comment.objects.create(post=self.quiet, author=self.reader, text="1")
+        Comment.objects.create(post=self.quiet, author=self.reader, text="2")
+        cache.clear()
+        self.assertEqual(self.ranking(), ["quiet", "busy"])
+        self.assertEqual(self.ranking("/group/cats/trending/"), ["busy"])
+
+    def test_old_events_weigh_less(self):
+        now = timezone.now()
+        old = now - timedelta(hours=24)
+        for at in (old, old, old):
+            trending.record(self.busy.pk, self.group.pk, "comment", at)
+        trending.record(self.quiet.pk, None, "comment", now)
+        scores = {row.pk: trending.current_score(row.score, now)
+                  for row in TrendingPost.objects.all()}
+        # Три комментария сутки (4 полураспада) назад весят меньше одного свежего
+        self.assertGreater(scores[self.quiet.pk], scores[self.busy.pk])
+        self.assertAlmostEqual(scores[self.quiet.pk], 2, places=3)
+
+    def test_follow_and_group_change(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertGreater(TrendingPost.objects.get(pk=self.busy.pk).score,
+                           TrendingPost.objects.get(pk=self.quiet.pk).score)
+        self.busy.group = None
+        self.busy.save()
+        self.assertIsNone(TrendingPost.objects.get(pk=self.busy.pk).group_id)
+
+    def test_prune_and_rebuild(self):
+        later = timezone.now() + timedelta(days=30)
+        self.assertEqual(trending.prune(later), 2)
+        self.assertFalse(TrendingPost.objects.exists())
+
+        Comment.objects.create(post=self.quiet, author=self.reader, text="1")
+        TrendingPost.objects.all().delete()
+        out = StringIO()
+        call_command("decay_trending", "--rebuild", stdout=out)
+        self.assertIn("Пересчитано постов: 2", out.getvalue())
+        rows = {row.pk: row for row in TrendingPost.objects.all()}
+        self.assertEqual(rows[self.busy.pk].group_id, self.group.pk)
+        self.assertGreater(rows[self.quiet.pk].score, rows[self.busy.pk].score)
+
+    def test_failed_rebuild_keeps_old_scores(self):
+        before = TrendingPost.objects.count()
+        with mock.patch.object(TrendingPost.objects, "bulk_create",
+                               side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                trending.rebuild()
+        self.assertEqual(TrendingPost.objects.count(), before)
@@ -0,0 +1,180 @@
+"""Генерация миниатюр вне запроса.
+
+Теги {% post_picture %} и {% thumbnail %} ходят в sorl через
+THUMBNAIL_BACKEND. Отложенный бэкенд отдаёт только уже готовые
+миниатюры, а для отсутствующих ставит задачу в пул фоновых потоков и
+возвращает None: шаблон показывает оригинал картинки. Задачи ставятся
+после COMMIT текущей транзакции, поэтому воркер никогда не видит
+незакоммиченный пост.
+Готовая миниатюра сбрасывает версию постов с этой картинкой: меняются
+ETag страниц, и клиенты получают разметку уже с миниатюрами.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE, KVStore as CachedDbKVStore)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from . import caching
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Пропорции обложки поста: все варианты режутся в 960x339
+POST_IMAGE_RATIO = (960, 339)
+
+
+def post_variants():
+    """Варианты картинки поста для srcset: (формат, ширина, геометрия,
+    опции sorl). Последний формат в POST_IMAGE_FORMATS - запасной для <img>,
+    остальные уходят в <source> тега <picture>."""
+    width, height = POST_IMAGE_RATIO
+    quality = getattr(settings, "POST_IMAGE_QUALITY", 80)
+    variants = []
+    for format_ in getattr(settings, "POST_IMAGE_FORMATS", ("WEBP", "JPEG")):
+        for size in getattr(settings, "POST_IMAGE_WIDTHS", (320, 640, 960)):
+            geometry = "%sx%s" % (size, round(size * height / width))
+            options = {"crop": "center", "upscale": True,
+                       "format": format_, "quality": quality}
+            variants.append((format_, size, geometry, options))
+    return variants
+
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "THUMBNAIL_WORKERS", 2),
+                thread_name_prefix="thumbnails")
+    return _executor
+
+
+def job_key(name, geometry, options):
+    return name, geometry, tuple(sorted(options.items()))
+
+
+def generate(name, geometry, options):
+    """Создаёт миниатюру синхронно; выполняется в фоновом потоке."""
+    try:
+        ThumbnailBackend().get_thumbnail(name, geometry, **options)
+        caching.forget_posts(
+            *Post.objects.filter(image=name).values_list("pk", flat=True))
+    except Exception:
+        logger.exception("Не удалось создать миниатюру %s %s", name, geometry)
+    finally:
+        with _lock:
+            _pending.discard(job_key(name, geometry, options))
+        close_old_connections()
+
+
+def enqueue(name, geometry, options):
+    key = job_key(name, geometry, options)
+
+    def submit():
+        with _lock:
+            if key in _pending:
+                return
+            _pending.add(key)
+        executor().submit(generate, name, geometry, options)
+
+    transaction.on_commit(submit)
+
+
+def ready_images(names):
+    """Миниатюры sorl по именам или None, если их ещё нет: одним get_many
+    из кэша key-value хранилища, промахи - одним запросом к его таблице."""
+    kvstore = default.kvstore
+    files = [ImageFile(name, default.storage) for name in names]
+    if not isinstance(kvstore, CachedDbKVStore):
+        return [kvstore.get(file_) for file_ in files]
+    keys = [add_prefix(file_.key) for file_ in files]
+    found = {key: value for key, value in kvstore.cache.get_many(keys).items()
+             if value is not None}
+    missing = [key for key in keys if key not in found]
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(
+            key__in=missing).values_list("key", "value"))
+        # Как в cached_db_kvstore: отсутствие тоже кэшируется
+        loaded = {key: stored.get(key, EMPTY_VALUE) for key in missing}
+        kvstore.cache.set_many(loaded, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(loaded)
+    return [None if found[key] == EMPTY_VALUE or not found[key]
+            else deserialize_image_file(found[key]) for key in keys]
+
+
+def ready_variants(image):
+    """Пары (вариант из post_variants(), миниатюра или None) для картинки
+    поста. Все варианты ищутся одним ready_images; результат запоминается
+    на image, чтобы карточка не искала их второй раз (post_cards)."""
+    if getattr(image, "_ready_variants", None) is None:
+        variants = post_variants()
+        if getattr(settings, "THUMBNAIL_DEFERRED", True):
+            backend = DeferredThumbnailBackend()
+            thumbnails = ready_images([
+                backend.thumbnail_name(image, geometry, options)
+                for _, _, geometry, options in variants])
+        else:
+            thumbnails = [
+                default.backend.get_thumbnail(image, geometry, **options)
+                for _, _, geometry, options in variants]
+        image._ready_variants = list(zip(variants, thumbnails))
+    return image._ready_variants
+
+
+def variants_ready(image):
+    """Созданы ли уже все варианты картинки поста."""
+    return all(thumbnail is not None
+               for _, thumbnail in ready_variants(image))
+
+
+def enqueue_post(post):
+    if post.image:
+        for _, _, geometry, options in post_variants():
+            enqueue(post.image.name, geometry, options)
+
+
+class DeferredThumbnailBackend(ThumbnailBackend):
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_ or not getattr(settings, "THUMBNAIL_DEFERRED", True):
+            return super().get_thumbnail(file_, geometry_string, **options)
+        thumbnail = self.get_ready_thumbnail(file_, geometry_string, options)
+        if thumbnail is None:
+            enqueue(getattr(file_, "name", file_), geometry_string, options)
+        return thumbnail
+
+    def get_ready_thumbnail(self, file_, geometry_string, options):
+        """Ищет миниатюру в key-value хранилище sorl, не открывая
+        исходную картинку."""
+        name = self.thumbnail_name(file_, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+    def thumbnail_name(self, file_, geometry_string, options):
+        """Имя файла миниатюры, вычисленное так же, как в get_thumbnail."""
+        source = ImageFile(file_)
+        options = dict(options)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault("format", self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return self._get_thumbnail_filename(source, geometry_string, options)
+
@@ -0,0 +1,178 @@
+"""Лента подписок с раскладкой постов при записи (fan-out on write).
+
+Пост автора сразу копируется в TimelineEntry каждого подписчика, и
+follow_index читает один диапазон индекса (user, -pub_date, -post).
+Посты авторов, у которых подписчиков не меньше TIMELINE_FANOUT_THRESHOLD,
+не раскладываются: они подмешиваются при чтении (fan-out on read)
+запросом по автору, иначе одна публикация писала бы миллионы строк.
+Когда после отписок автор опускается ниже порога, его посты раскладываются
+всем оставшимся подписчикам (cool_down), иначе опубликованное за время
+популярности пропало бы из их лент. Это тысячи подписчиков на тысячу
+постов, поэтому раскладка идёт в фоновом потоке после COMMIT отписки,
+порциями по TIMELINE_BATCH_SIZE подписчиков.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.functional import cached_property
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginator import CursorPaginator
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def fanout_threshold():
+    return getattr(settings, "TIMELINE_FANOUT_THRESHOLD", 10000)
+
+
+def batch_size():
+    return getattr(settings, "TIMELINE_BATCH_SIZE", 1000)
+
+
+def is_hot(author_id):
+    return UserStats.objects.filter(
+        user_id=author_id, followers_count__gte=fanout_threshold()).exists()
+
+
+def _insert(entries):
+    entries = iter(entries)
+    size = batch_size()
+    while True:
+        batch = list(islice(entries, size))
+        if not batch:
+            return
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_hot(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list("user_id", flat=True)
+    _insert(
+        TimelineEntry(user_id=user_id, post_id=post.pk,
+                      author_id=post.author_id, pub_date=post.pub_date)
+        for user_id in followers.iterator())
+
+
+def latest_posts(author_id):
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        "-pub_date", "-pk").values_list("pk", "pub_date")
+    limit = getattr(settings, "TIMELINE_BACKFILL_LIMIT", None)
+    if limit is not None:
+        posts = posts[:limit]
+    return posts
+
+
+def backfill(follow):
+    """Добавляет в ленту подписчика последние посты нового автора."""
+    if is_hot(follow.author_id):
+        return
+    _insert(
+        TimelineEntry(user_id=follow.user_id, post_id=pk,
+                      author_id=follow.author_id, pub_date=pub_date)
+        for pk, pub_date in latest_posts(follow.author_id).iterator())
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="timeline")
+    return _executor
+
+
+def schedule_cool_down(author_id):
+    """Вызывается после отписки: если автор только что опустился ниже
+    порога, ставит cool_down в фоновый поток после COMMIT."""
+    if UserStats.objects.filter(
+            user_id=author_id,
+            followers_count=fanout_threshold() - 1).exists():
+        transaction.on_commit(
+            lambda: executor().submit(cool_down, author_id))
+
+
+def cool_down(author_id):
+    """Раскладывает последние посты автора всем подписчикам: порциями по
+    batch_size() подписчиков, каждая - своими bulk_create."""
+    # caching импортирует timeline
+    from . import caching
+
+    try:
+        if is_hot(author_id):
+            return
+        posts = list(latest_posts(author_id))
+        followers = Follow.objects.filter(author_id=author_id).order_by(
+            "user_id").values_list("user_id", flat=True)
+        last = 0
+        while True:
+            chunk = list(followers.filter(user_id__gt=last)[:batch_size()])
+            if not chunk:
+                break
+            _insert(
+                TimelineEntry(user_id=user_id, post_id=pk,
+                              author_id=author_id, pub_date=pub_date)
+                for user_id in chunk for pk, pub_date in posts)
+            last = chunk[-1]
+        # До этого момента ленты подписок показывали посты автора как
+        # «популярного»; теперь они берутся из TimelineEntry
+        caching.invalidate("hot")
+    except Exception:
+        logger.exception("Не удалось разложить посты автора %s", author_id)
+    finally:
+        close_old_connections()
+
+
+def prune(follow):
+    """Убирает из ленты посты автора, от которого отписались."""
+    TimelineEntry.objects.filter(
+        user_id=follow.user_id, author_id=follow.author_id).delete()
+
+
+class TimelinePaginator(CursorPaginator):
+    """Курсорная пагинация ленты подписок.
+
+    Разложенные посты читаются из TimelineEntry, посты «популярных»
+    авторов - из Post; оба источника сортируются по (pub_date, id поста),
+    поэтому курсоры у них общие, а страница получается слиянием.
+    """
+
+    def __init__(self, user, per_page):
+        super().__init__(Post.objects.feed(), per_page)
+        self.user = user
+
+    @cached_property
+    def sources(self):
+        entries = TimelineEntry.objects.filter(user=self.user).select_related(
+            "post__author", "post__group")
+        sources = [CursorPaginator(
+            entries, self.per_page, ordering=("-pub_date", "-post_id"))]
+        hot = list(Follow.objects.filter(
+            user=self.user,
+            author__stats__followers_count__gte=fanout_threshold(),
+        ).values_list("author_id", flat=True))
+        if hot:
+            sources.append(CursorPaginator(
+                Post.objects.feed().filter(author_id__in=hot), self.per_page))
+        return sources
+
+    def fetch(self, values, forward):
+        posts = {}
+        for source in self.sources:
+            for row in source.fetch(values, forward):
+                post = row.post if isinstance(row, TimelineEntry) else row
+                posts[post.pk] = post
+        rows = sorted(posts.values(), key=lambda post: (post.pub_date, post.pk),
+                      reverse=forward)
+        return rows[:self.per_page + 1]
@@ -0,0 +1,133 @@
+"""Популярные посты: рейтинг с экспоненциальным затуханием.
+
+Каждое событие (публикация, комментарий, подписка на автора) весом w в
+момент t добавляет к рейтингу поста w * 2 ** (-(now - t) / half_life).
+Вместо того чтобы уменьшать все рейтинги со временем, в TrendingPost
+хранится log(sum(w * exp(lambda * (t - EPOCH)))) - «прямое затухание»:
+общий множитель exp(-lambda * (now - EPOCH)) у всех постов одинаковый и
+на порядок не влияет. Поэтому событие - это один UPDATE с logaddexp, а
+лента - чтение диапазона индекса (group, -score).
+
+Команда decay_trending удаляет посты, чей текущий рейтинг упал ниже
+TRENDING_MIN_SCORE, и умеет пересчитать таблицу по постам и комментариям.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from .models import Comment, Post, TrendingPost
+
+EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def weights():
+    return getattr(settings, "TRENDING_WEIGHTS",
+                   {"post": 1.0, "comment": 1.0, "follow": 2.0})
+
+
+def decay_rate():
+    """lambda в 1/с: за TRENDING_HALF_LIFE секунд рейтинг падает вдвое."""
+    return math.log(2) / getattr(settings, "TRENDING_HALF_LIFE", 6 * 3600)
+
+
+def log_weight(weight, at):
+    return math.log(weight) + decay_rate() * (at - EPOCH).total_seconds()
+
+
+def current_score(score, now=None):
+    """Рейтинг из TrendingPost.score на момент now."""
+    now = now or timezone.now()
+    return math.exp(score - decay_rate() * (now - EPOCH).total_seconds())
+
+
+def logaddexp(a, b):
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def start(post_id, group_id, at=None):
+    """Рейтинг нового поста: строки ещё нет, поэтому сразу INSERT."""
+    TrendingPost.objects.bulk_create([TrendingPost(
+        post_id=post_id, group_id=group_id,
+        score=log_weight(weights()["post"], at or timezone.now()))],
+        ignore_conflicts=True)
+
+
+def record(post_id, group_id, kind, at=None):
+    """Добавляет событие kind ("post", "comment", "follow") к рейтингу."""
+    value = log_weight(weights()[kind], at or timezone.now())
+    # logaddexp в SQL: max(a, b) + ln(1 + exp(-|a - b|))
+    updated = TrendingPost.objects.filter(post_id=post_id).update(
+        score=Greatest(F("score"), Value(value))
+        + Ln(Value(1.0) + Exp(-Abs(F("score") - Value(value)))))
+    if not updated:
+        TrendingPost.objects.bulk_create(
+            [TrendingPost(post_id=post_id, group_id=group_id, score=value)],
+            ignore_conflicts=True)
+
+
+def record_follow(author_id):
+    """Подписка поднимает последний пост автора."""
+    post = Post.objects.filter(author_id=author_id).order_by(
+        "-pub_date", "-pk").values("pk", "group_id").first()
+    if post is not None:
+        record(post["pk"], post["group_id"], "follow")
+
+
+def move_to_group(post_id, group_id):
+    TrendingPost.objects.filter(post_id=post_id).update(group_id=group_id)
+
+
+def threshold(now=None):
+    """score, ниже которого текущий рейтинг меньше TRENDING_MIN_SCORE."""
+    now = now or timezone.now()
+    return (math.log(getattr(settings, "TRENDING_MIN_SCORE", 0.05))
+            + decay_rate() * (now - EPOCH).total_seconds())
+
+
+def prune(now=None):
+    """Удаляет затухшие посты; возвращает число удалённых."""
+    deleted, _ = TrendingPost.objects.filter(score__lt=threshold(now)).delete()
+    return deleted
+
+
+def rebuild(now=None, batch_size=1000):
+    """Пересчитывает рейтинг по публикациям и комментариям за последние
+    TRENDING_REBUILD_HALF_LIVES периодов полураспада. Подписки в
+    пересчёт не входят: у них нет времени создания."""
+    now = now or timezone.now()
+    since = now - timedelta(seconds=math.log(2) / decay_rate() * getattr(
+        settings, "TRENDING_REBUILD_HALF_LIVES", 10))
+    # Чтение и замена таблицы - одна транзакция: читатели до COMMIT видят
+    # старые рейтинги, а не пустую таблицу, и публикации с комментариями,
+    # записанные до замены, попадают в пересчёт.
+    with transaction.atomic():
+        scores, groups = {}, {}
+
+        def add(post_id, value):
+            scores[post_id] = (logaddexp(scores[post_id], value)
+                               if post_id in scores else value)
+
+        posts = Post.objects.filter(pub_date__gte=since).values_list(
+            "pk", "group_id", "pub_date")
+        for pk, group_id, pub_date in posts.iterator():
+            groups[pk] = group_id
+            add(pk, log_weight(weights()["post"], pub_date))
+        comments = Comment.objects.filter(created__gte=since).values_list(
+            "post_id", "post__group_id", "created")
+        for post_id, group_id, created in comments.iterator():
+            groups[post_id] = group_id
+            add(post_id, log_weight(weights()["comment"], created))
+
+        minimum = threshold(now)
+        TrendingPost.objects.all().delete()
+        TrendingPost.objects.bulk_create(
+            (TrendingPost(post_id=pk, group_id=groups[pk], score=score)
+             for pk, score in scores.items() if score >= minimum),
+            batch_size=batch_size)
+    return len(scores)
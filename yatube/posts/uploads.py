@@ -0,0 +1,133 @@
+"""Загрузка картинок постов без лишней памяти и без декомпрессионных бомб.
+
+Файлы больше FILE_UPLOAD_MAX_MEMORY_SIZE Django пишет во временный файл
+кусками. SizeLimitUploadHandler стоит перед стандартными обработчиками и
+перестаёт передавать им данные, как только файл превысил
+POST_IMAGE_MAX_UPLOAD_SIZE: вместо файла форма получает пустую заглушку
+и показывает ошибку.
+
+BoundedImageField читает только заголовок картинки и отклоняет слишком
+большие по числу пикселей до того, как Pillow начнёт её декодировать.
+Принятая картинка перекодируется: уменьшается до POST_IMAGE_MAX_SIDE по
+большей стороне, поворачивается по EXIF, а сами метаданные EXIF
+отбрасываются.
+"""
+import io
+import os
+import tempfile
+import warnings
+
+from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+
+
+def max_upload_size():
+    return getattr(settings, "POST_IMAGE_MAX_UPLOAD_SIZE", 10 * 1024 * 1024)
+
+
+def max_pixels():
+    return getattr(settings, "POST_IMAGE_MAX_PIXELS", 40000000)
+
+
+def max_side():
+    return getattr(settings, "POST_IMAGE_MAX_SIDE", 2048)
+
+
+class OversizedUpload(UploadedFile):
+    """Заглушка вместо файла, превысившего лимит: только имя и размер."""
+
+    def __init__(self, name, content_type, size):
+        super().__init__(io.BytesIO(), name, content_type, size)
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > max_upload_size():
+            # None не пускает кусок к следующим обработчикам
+            return None
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.received > max_upload_size():
+            return OversizedUpload(self.file_name, self.content_type,
+                                   self.received)
+        return None
+
+
+class BoundedImageField(forms.ImageField):
+    default_error_messages = {
+        "too_large": "Файл слишком большой, максимум %(limit)s.",
+        "too_many_pixels": "Картинка слишком большая: %(width)s×%(height)s.",
+    }
+
+    def to_python(self, data):
+        upload = forms.FileField.to_python(self, data)
+        if upload is None:
+            return None
+        if isinstance(upload, OversizedUpload) or upload.size > max_upload_size():
+            raise forms.ValidationError(
+                self.error_messages["too_large"], code="too_large",
+                params={"limit": filesizeformat(max_upload_size())})
+        self.check_dimensions(upload)
+        return normalize_image(super().to_python(data))
+
+    def check_dimensions(self, upload):
+        """Image.open читает только заголовок, пиксели не декодируются."""
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                width, height = Image.open(upload).size
+        except Image.DecompressionBombError:
+            width = height = None
+        except Exception:
+            # Не картинка: ошибку покажет ImageField
+            return
+        finally:
+            upload.seek(0)
+        if width is None or width * height > max_pixels():
+            raise forms.ValidationError(
+                self.error_messages["too_many_pixels"],
+                code="too_many_pixels",
+                params={"width": width or "?", "height": height or "?"})
+
+
+def normalize_image(upload):
+    """Перекодирует картинку без EXIF, не больше max_side() по стороне."""
+    upload.seek(0)
+    image = Image.open(upload)
+    side = max_side()
+    if image.format == "JPEG":
+        # JPEG сразу декодируется в уменьшенном масштабе (1/2, 1/4, 1/8)
+        image.draft("RGB", (side, side))
+    icc_profile = image.info.get("icc_profile")
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((side, side), Image.LANCZOS)
+
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        format_, extension, content_type = "PNG", ".png", "image/png"
+        params = {"optimize": True}
+    else:
+        format_, extension, content_type = "JPEG", ".jpg", "image/jpeg"
+        params = {"quality": 90, "optimize": True, "progressive": True}
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+    if icc_profile:
+        params["icc_profile"] = icc_profile
+
+    name = os.path.splitext(os.path.basename(upload.name))[0] + extension
+    buffer = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+        dir=settings.FILE_UPLOAD_TEMP_DIR)
+    image.save(buffer, format_, **params)
+    size = buffer.tell()
+    buffer.seek(0)
+    return UploadedFile(buffer, name, content_type, size)
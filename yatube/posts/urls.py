@@ -5,12 +5,18 @@ from . import views
 urlpatterns = [
     path("", views.index, name="index"),
     path("group/<slug>/", views.group_posts, name="group"),
+    path("group/<slug>/trending/", views.group_trending,
+         name="group_trending"),
+    path("trending/", views.trending, name="trending"),
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search, name="search"),
     path("<username>/", views.profile, name="profile"),
     path("<username>/<int:post_id>/", views.post_view, name="post"),
     path("<username>/<int:post_id>/edit/",
          views.post_edit, name="post_edit"),
+    path("<username>/<int:post_id>/comments/",
+         views.post_comments, name="post_comments"),
     path("<username>/<int:post_id>/comment/",
          views.add_comment, name="add_comment"),
     path("<username>/follow/", views.profile_follow, name="profile_follow"),
@@ -1,37 +1,79 @@
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Post, Group, Comment, Follow
+from .models import Post, Group, Follow, TrendingPost, UserStats
 from .forms import PostForm, CommentForm
+from . import caching, thumbnails
+from .conditional import (comments_etag, conditional_page, follow_etag,
+                          group_etag, index_etag, post_etag, profile_etag)
+from .search import SearchResults
+from .paginator import CursorPage, CursorPaginator
+from .timeline import TimelinePaginator
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
+@conditional_page(index_etag)
 def index(request):
-    post_list = Post.objects.order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.feed()
+    page, paginator = caching.feed_page(
+        request, 'index', ['index'], post_list, 10)
     return render(request, 'index.html', {'page': page, 'paginator': paginator})
 
 
+@conditional_page(group_etag)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = Post.objects.filter(group=group).order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.feed().filter(group=group)
+    page, paginator = caching.feed_page(
+        request, 'group', ['group:%s' % group.pk], post_list, 10)
     return render(request, "group.html", {"group": group, 'page': page, 'paginator': paginator})
 
 
+def trending_page(request, rows, per_page):
+    """Страница популярных постов: диапазон индекса по score, сами посты
+    - из кэша (caching.get_posts)."""
+    paginator = CursorPaginator(rows, per_page, ordering=("-score", "-pk"))
+    page = paginator.get_page(request.GET.get('cursor'))
+    posts = caching.get_posts([row.pk for row in page])
+    return CursorPage(posts, page.next_cursor, page.previous_cursor), paginator
+
+
+def trending(request):
+    page, paginator = trending_page(request, TrendingPost.objects.all(), 10)
+    return render(request, 'trending.html', {'page': page, 'paginator': paginator})
+
+
+def group_trending(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    page, paginator = trending_page(
+        request, TrendingPost.objects.filter(group=group), 10)
+    return render(request, 'trending.html',
+                  {'group': group, 'page': page, 'paginator': paginator})
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page = paginator = None
+    if query:
+        paginator = Paginator(SearchResults(query), 10)
+        page = paginator.get_page(request.GET.get('page'))
+    return render(request, 'search.html',
+                  {'query': query, 'page': page, 'paginator': paginator})
+
+
 @login_required
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if request.POST and form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        with transaction.atomic():
+            post.save()
+            thumbnails.enqueue_post(post)
         return redirect('index')
     return render(request, 'new_post.html', {'form': form})
 
@@ -46,14 +88,19 @@ def post_edit(request, username, post_id):
     form = PostForm(request.POST or None,
                     files=request.FILES or None, instance=post)
     if request.POST and form.is_valid():
-        form.save()
+        with transaction.atomic():
+            form.save()
+            if 'image' in form.changed_data:
+                thumbnails.enqueue_post(post)
         return redirect("post", username=request.user.username, post_id=post_id)
 
     return render(request, "new_post.html", {'form': form, 'post': post})
 
 
+@conditional_page(profile_etag)
 def profile(request, username):
-    profile = get_object_or_404(User, username=username)
+    profile = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
 
     following = False
     if request.user.is_authenticated:
@@ -62,33 +109,42 @@ def profile(request, username):
     else:
         following = False
 
-    followers = Follow.objects.filter(author=profile).count()
-    follower = Follow.objects.filter(user=profile).count()
-
-    post_list = Post.objects.filter(
-        author=profile).order_by("-pub_date").all()
-    number_of_posts = post_list.count()
-    paginator = Paginator(post_list, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    stats = UserStats.for_user(profile)
+    post_list = Post.objects.feed().filter(author=profile)
+    page, paginator = caching.feed_page(
+        request, 'profile', ['profile:%s' % profile.pk], post_list, 5)
     return render(request, "profile.html", {'profile': profile, 'page': page, 'paginator': paginator,
-                                            'number_of_posts': number_of_posts, 'following': following,
-                                            'follower': follower, 'followers': followers})
+                                            'number_of_posts': stats.posts_count, 'following': following,
+                                            'follower': stats.following_count,
+                                            'followers': stats.followers_count})
 
 
+@conditional_page(post_etag)
 def post_view(request, username, post_id):
-    profile = get_object_or_404(User, username=username)
-
-    followers = Follow.objects.filter(author=profile).count()
-    follower = Follow.objects.filter(user=profile).count()
-
-    post = get_object_or_404(Post, pk=post_id)
-    number_of_posts = Post.objects.filter(author=profile).count()
-    comments = Comment.objects.filter(post=post).all()
+    profile = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    stats = UserStats.for_user(profile)
+
+    post = caching.get_post(post_id)
+    if post is None:
+        raise Http404
+    comments = caching.comments_page(post)
     form = CommentForm(request.POST)
     return render(request, "post.html", {'post': post, "profile": profile,
-                                         'number_of_posts': number_of_posts, 'form': form, 'items': comments,
-                                         'follower': follower, 'followers': followers})
+                                         'number_of_posts': stats.posts_count, 'form': form, 'items': comments,
+                                         'follower': stats.following_count,
+                                         'followers': stats.followers_count})
+
+
+@conditional_page(comments_etag)
+def post_comments(request, username, post_id):
+    """Следующие страницы комментариев поста - HTML-фрагментом для
+    подгрузки на странице поста."""
+    post = caching.get_post(post_id)
+    if post is None or post.author.username != username:
+        raise Http404
+    comments = caching.comments_page(post, request.GET.get('cursor'))
+    return render(request, "comment_list.html", {'post': post, 'items': comments})
 
 
 @login_required
@@ -99,34 +155,37 @@ def add_comment(request, username, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
         return redirect('post', username=username, post_id=post_id)
     return render(request, "comments.html", {'form': form, 'post': post})
 
 
 @login_required
+@conditional_page(follow_etag)
 def follow_index(request):
     follows = Follow.objects.filter(user=request.user)
-    post_list = Post.objects.filter(
-        author__in=follows.values_list('author')).order_by("-pub_date")
-    paginator = Paginator(post_list, 5)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.feed().filter(
+        author__in=follows.values_list('author'))
+    page, paginator = caching.feed_page(
+        request, 'follow', ['follow:%s' % request.user.pk, 'hot'], post_list, 5,
+        TimelinePaginator(request.user, 5))
     return render(request, "follow.html", {'page': page, 'paginator': paginator, 'follows': follows})
 
 
 @login_required
 def profile_follow(request, username):
     profile = get_object_or_404(User, username=username)
-    if profile != request.user and not Follow.objects.filter(user=request.user, author=profile):
-        Follow.objects.create(user=request.user, author=profile)
+    if profile != request.user:
+        Follow.objects.get_or_create(user=request.user, author=profile)
     return redirect('profile', username=profile)
 
 
 @login_required
 def profile_unfollow(request, username):
     profile = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=request.user, author=profile).delete()
+    with transaction.atomic():
+        Follow.objects.filter(user=request.user, author=profile).delete()
     return redirect('profile', username=profile)
 
 
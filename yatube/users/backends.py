@@ -0,0 +1,48 @@
+"""Пользователь сессии из кэша.
+
+AuthenticationMiddleware на каждом запросе вошедшего пользователя
+загружает его из auth_user. CachedModelBackend держит загруженного
+пользователя в кэше памяти процесса (AUTH_USER_CACHE, не в общем кэше:
+в объекте хэш пароля) не дольше AUTH_USER_CACHE_TIMEOUT секунд. Ключ
+включает версию области "user:<id>" (posts/caching.py), которую
+сбрасывает смена пароля, имени или is_active (posts/signals.py,
+USER_FIELDS); вход, сохраняющий только last_login, её не трогает.
+Правки в обход сигналов (QuerySet.update(is_active=False) и т.п.)
+доходят до is_active и хэша сессии не позже чем через
+AUTH_USER_CACHE_TIMEOUT секунд, когда пользователь перечитывается из БД.
+После смены пароля остальные сессии пользователя, как и без кэша,
+разлогиниваются.
+
+    AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+
+AUTH_USER_CACHE_TIMEOUT = 0 отключает кэш.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from posts import caching
+
+USER_KEY = "users:auth:%s:%s"
+
+
+def timeout():
+    return getattr(settings, "AUTH_USER_CACHE_TIMEOUT", 30)
+
+
+def user_cache():
+    return caches[getattr(settings, "AUTH_USER_CACHE", "local")]
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        if not timeout():
+            return super().get_user(user_id)
+        key = USER_KEY % (
+            user_id, caching.versions(["user:%s" % user_id])[0])
+        user = user_cache().get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                user_cache().set(key, user, timeout())
+        return user
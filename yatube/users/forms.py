@@ -1,8 +1,26 @@
+from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import get_user_model
+from django.urls import Resolver404, resolve
 
 User = get_user_model()
 
+# Адреса страниц пользователя; имя, при котором какой-то из них достаётся
+# другой вьюхе (search/, trending/, group/<slug>/ и т.п.), занято сайтом
+USER_PATHS = (("/%s/", "profile"), ("/%s/1/", "post"),
+              ("/%s/follow/", "profile_follow"))
+
+
+def is_reserved(username):
+    for path, url_name in USER_PATHS:
+        try:
+            match = resolve(path % username)
+        except Resolver404:
+            return True
+        if match.url_name != url_name:
+            return True
+    return False
+
 #  класс для формы регистрации
 
 
@@ -10,3 +28,10 @@ class CreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
         model = User
         fields = ("first_name", "last_name", "username", "email")
+
+    def clean_username(self):
+        username = self.cleaned_data["username"]
+        if is_reserved(username):
+            raise forms.ValidationError(
+                "Это имя занято адресом страницы сайта")
+        return username
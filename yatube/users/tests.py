@@ -1,3 +1,105 @@
-from django.test import TestCase
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from posts import caching
+
+from .backends import USER_KEY
+from .forms import CreationForm
+
+User = get_user_model()
+
+SESSION_ENGINES = {
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+
+
+class CachedSessionUserTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches["local"].clear()
+        self.user = User.objects.create_user(
+            username="leo", password="12345", first_name="Лев")
+
+    def auth_queries(self, client, url="/"):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query["sql"] for query in context.captured_queries
+                if "django_session" in query["sql"]
+                or 'FROM "auth_user"' in query["sql"]], response
+
+    def test_logged_in_requests_skip_session_and_user_queries(self):
+        for name, engine in SESSION_ENGINES.items():
+            with self.subTest(engine=name), \
+                    override_settings(SESSION_ENGINE=engine):
+                client = Client()
+                client.login(username="leo", password="12345")
+                client.get("/")
+                queries, response = self.auth_queries(client)
+                self.assertEqual(queries, [])
+                self.assertEqual(response.context["user"], self.user)
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=0)
+    def test_cache_can_be_disabled(self):
+        client = Client()
+        client.login(username="leo", password="12345")
+        client.get("/")
+        queries, _ = self.auth_queries(client)
+        self.assertEqual(len(queries), 1)
+
+    def test_profile_change_refreshes_cached_user(self):
+        client = Client()
+        client.login(username="leo", password="12345")
+        client.get("/")
+        self.user.first_name = "Лёва"
+        self.user.save()
+        _, response = self.auth_queries(client)
+        self.assertEqual(response.context["user"].first_name, "Лёва")
+
+    def test_password_change_logs_out_other_sessions(self):
+        client = Client()
+        client.login(username="leo", password="12345")
+        client.get("/")
+        self.user.set_password("new-password")
+        self.user.save()
+        _, response = self.auth_queries(client)
+        self.assertFalse(response.context["user"].is_authenticated)
+
+    def test_password_hash_stays_out_of_shared_cache(self):
+        client = Client()
+        client.login(username="leo", password="12345")
+        client.get("/")
+        key = USER_KEY % (
+            self.user.pk, caching.versions(["user:%s" % self.user.pk])[0])
+        self.assertEqual(caches["local"].get(key), self.user)
+        self.assertIsNone(cache.get(key))
+
+    def test_update_without_signals_is_seen_after_timeout(self):
+        client = Client()
+        client.login(username="leo", password="12345")
+        client.get("/")
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        later = time.time() + 31
+        with mock.patch("time.time", return_value=later):
+            _, response = self.auth_queries(client)
+        self.assertFalse(response.context["user"].is_authenticated)
+
+
+class SignUpTest(TestCase):
+    def form(self, username):
+        return CreationForm({"username": username, "password1": "Zx12cv34bn",
+                             "password2": "Zx12cv34bn"})
+
+    def test_site_paths_are_reserved(self):
+        for username in ("search", "trending", "group", "admin"):
+            with self.subTest(username=username):
+                form = self.form(username)
+                self.assertFalse(form.is_valid())
+                self.assertIn("username", form.errors)
+        self.assertTrue(self.form("leo").is_valid())
@@ -0,0 +1,152 @@
+"""Статика: хэшированные имена, сжатые копии и отдача с долгим кэшем.
+
+collectstatic (или python manage.py build_assets) со storage
+CompressedManifestStaticFilesStorage копирует файлы в STATIC_ROOT,
+создаёт копии с хэшем содержимого в имени (bootstrap.min.3f2a....css)
+и рядом с каждым текстовым файлом кладёт .gz и, если установлен brotli,
+.br. CSS и JS без .min в имени минифицируются, если установлены rcssmin
+и rjsmin. Исходники библиотек (scss, src) в STATIC_ROOT не копируются:
+страницы грузят собранные файлы из dist (SOURCE_PATTERNS).
+
+serve отдаёт файлы из STATIC_ROOT: готовую .br/.gz-копию по
+Accept-Encoding, а для хэшированных имён - Cache-Control на год с
+immutable, так что браузер больше не спрашивает их вовсе.
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".map", ".txt", ".xml",
+                ".html", ".ico", ".ttf", ".otf", ".eot")
+MIN_COMPRESS_SIZE = 256
+# Имя, которое дал ManifestStaticFilesStorage: name.<12 hex>.ext
+HASHED_RE = re.compile(r"\.[0-9a-f]{12}\.[^./]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# Исходники и метаданные пакетов из posts/static, которые страницы не грузят
+SOURCE_PATTERNS = ["scss", "src", "*.md", "*.json", "*.flow", "*.d.ts"]
+
+
+def minify(name, content):
+    if ".min." in name:
+        return content
+    if name.endswith(".css") and rcssmin is not None:
+        return rcssmin.cssmin(content)
+    if name.endswith(".js") and rjsmin is not None:
+        return rjsmin.jsmin(content)
+    return content
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def _save(self, name, content):
+        if name.endswith((".css", ".js")) and (rcssmin or rjsmin):
+            # chunks() читает с начала: при хэшировании файл уже прочитан
+            data = b"".join(content.chunks())
+            try:
+                content = ContentFile(minify(name, data.decode()).encode())
+            except UnicodeDecodeError:
+                # Не UTF-8 - сохраняем как есть, без минификации
+                content = ContentFile(data)
+        return super()._save(name, content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        variants = {".gz": gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(data):
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                super()._save(name + suffix, ContentFile(compressed))
+
+    def stored_name(self, name):
+        # Файла нет в манифесте (не собран или не существует) - ссылка на
+        # исходное имя вместо ошибки 500 на каждой странице
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+def accepted_encodings(request):
+    accepted = set()
+    for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00",
+                                           "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def serve(request, path):
+    """Файл из STATIC_ROOT с учётом сжатых копий и хэша в имени."""
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    encoding, served = None, fullpath
+    accepted = accepted_encodings(request)
+    for coding, suffix in ENCODINGS:
+        if coding in accepted and os.path.isfile(fullpath + suffix):
+            encoding, served = coding, fullpath + suffix
+            break
+
+    stat = os.stat(served)
+    etag = '"%x-%x%s"' % (int(stat.st_mtime), stat.st_size,
+                          "-" + encoding if encoding else "")
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type, _ = mimetypes.guess_type(fullpath)
+        response = FileResponse(open(served, "rb"),
+                                content_type=content_type or
+                                "application/octet-stream")
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Cache-Control"] = (IMMUTABLE if HASHED_RE.search(path)
+                                 else "public, no-cache")
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
@@ -0,0 +1,252 @@
+"""Двухуровневый кэш: маленький LRU в памяти процесса перед общим кэшем.
+
+L1 живёт в каждом воркере и отвечает без сетевого запроса, L2 - любой
+общий бэкенд из CACHES (Redis в продакшене, файловый кэш локально и в
+тестах). Все записи идут в L2, чтение - сначала из L1.
+
+Межпроцессная инвалидация - по ключам: delete, delete_many и incr
+увеличивают в L2 счётчик инвалидаций и кладут под его номером список
+удалённых ключей. Каждый процесс не реже раза в SYNC_INTERVAL секунд
+сверяет счётчик со своим и удаляет из L1 только перечисленные ключи.
+Если процесс отстал больше чем на MAX_BACKLOG записей или часть записей
+уже истекла, он очищает L1 целиком. Так же целиком L1 очищается при
+смене «поколения» - его меняет только clear(). set() ничего не
+рассылает: ключи с версиями в имени (см. posts/caching.py) не
+перезаписываются, а для остальных устаревание ограничено LOCAL_TIMEOUT.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.cache.TieredCache',
+            'OPTIONS': {'SHARED': 'shared', 'LOCAL_MAX_ENTRIES': 1000},
+        },
+        'shared': {...},
+    }
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .instrumentation import record_cache
+
+GENERATION_KEY = "tiered:generation"
+SEQUENCE_KEY = "tiered:sequence"
+INVALIDATION_KEY = "tiered:invalidation:%s"
+# Сколько живут записи об удалённых ключах и сколько записей процесс
+# готов дочитать, прежде чем очистить L1 целиком
+INVALIDATION_TIMEOUT = 60
+MAX_BACKLOG = 100
+MISSING = object()
+
+
+class LocalLRU:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            data, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(data)
+
+    def set(self, key, value, timeout):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (data, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.shared_alias = options.get("SHARED", "shared")
+        self.local_timeout = options.get("LOCAL_TIMEOUT", 5)
+        self.sync_interval = options.get("SYNC_INTERVAL", 1)
+        self.local = LocalLRU(options.get("LOCAL_MAX_ENTRIES", 1000))
+        self.generation = None
+        self.sequence = None
+        self.synced_at = None
+        self.sync_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def local_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def resolve(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def local_ttl(self, timeout):
+        timeout = self.resolve(timeout)
+        if timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def sync(self):
+        """Удаляет из L1 ключи, удалённые другими процессами."""
+        now = time.monotonic()
+        if self.synced_at is not None and now - self.synced_at < self.sync_interval:
+            return
+        with self.sync_lock:
+            state = self.shared.get_many([GENERATION_KEY, SEQUENCE_KEY])
+            generation = state.get(GENERATION_KEY)
+            if generation is None:
+                self.shared.add(GENERATION_KEY, uuid4().hex, None)
+                generation = self.shared.get(GENERATION_KEY)
+            sequence = state.get(SEQUENCE_KEY, 0)
+            if generation != self.generation:
+                self.local.clear()
+                self.generation = generation
+            elif sequence != self.sequence:
+                self.forget(sequence)
+            self.sequence = sequence
+            self.synced_at = now
+
+    def forget(self, sequence):
+        if self.sequence is None or not 0 < sequence - self.sequence <= MAX_BACKLOG:
+            self.local.clear()
+            return
+        wanted = [INVALIDATION_KEY % number
+                  for number in range(self.sequence + 1, sequence + 1)]
+        found = self.shared.get_many(wanted)
+        if len(found) < len(wanted):
+            self.local.clear()
+            return
+        for keys in found.values():
+            for key in keys:
+                self.local.delete(key)
+
+    def announce(self, local_keys):
+        """Сообщает другим процессам, какие ключи удалить из L1."""
+        try:
+            sequence = self.shared.incr(SEQUENCE_KEY)
+        except ValueError:
+            self.shared.add(SEQUENCE_KEY, 0, None)
+            sequence = self.shared.incr(SEQUENCE_KEY)
+        # Без атомарного incr (файловый кэш) два процесса могут получить
+        # один номер; тогда второй сбрасывает L1 всем через поколение
+        if not self.shared.add(INVALIDATION_KEY % sequence, list(local_keys),
+                               INVALIDATION_TIMEOUT):
+            self.publish()
+
+    def publish(self):
+        self.generation = uuid4().hex
+        self.shared.set(GENERATION_KEY, self.generation, None)
+
+    def get(self, key, default=None, version=None):
+        self.sync()
+        local_key = self.local_key(key, version)
+        value = self.local.get(local_key)
+        if value is not MISSING:
+            record_cache(hits=1)
+            return value
+        value = self.shared.get(key, MISSING, version=version)
+        if value is MISSING:
+            record_cache(misses=1)
+            return default
+        record_cache(hits=1)
+        self.local.set(local_key, value, self.local_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        self.sync()
+        found, missing = {}, []
+        for key in keys:
+            value = self.local.get(self.local_key(key, version))
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            loaded = self.shared.get_many(missing, version=version)
+            for key, value in loaded.items():
+                self.local.set(self.local_key(key, version), value,
+                               self.local_timeout)
+            found.update(loaded)
+        record_cache(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, self.resolve(timeout),
+                        version=version)
+        self.local.set(self.local_key(key, version), value,
+                       self.local_ttl(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(
+            data, self.resolve(timeout), version=version) or []
+        for key, value in data.items():
+            if key not in failed:
+                self.local.set(self.local_key(key, version), value,
+                               self.local_ttl(timeout))
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, self.resolve(timeout),
+                                version=version)
+        if added:
+            self.local.set(self.local_key(key, version), value,
+                           self.local_ttl(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, self.resolve(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return
+        self.shared.delete_many(keys, version=version)
+        local_keys = [self.local_key(key, version) for key in keys]
+        for key in local_keys:
+            self.local.delete(key)
+        self.announce(local_keys)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        local_key = self.local_key(key, version)
+        self.local.delete(local_key)
+        self.announce([local_key])
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+        self.publish()
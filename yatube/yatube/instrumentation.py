@@ -0,0 +1,150 @@
+"""Метрики запроса: SQL, рендеринг шаблонов и кэш.
+
+RequestMetricsMiddleware для доли запросов INSTRUMENTATION_SAMPLE_RATE
+собирает число и время SQL-запросов (через connection.execute_wrapper),
+повторы одинаковых запросов, время рендеринга шаблонов (бэкенд
+InstrumentedDjangoTemplates) и попадания в кэш (считает TieredCache).
+Итог пишется одной JSON-строкой в логгер yatube.requests, а при
+INSTRUMENTATION_HEADERS ещё и в заголовок Server-Timing, который видно
+во вкладке Network браузера.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger("yatube.requests")
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql, repr(params)] += 1
+
+    @property
+    def duplicates(self):
+        """Запросы, повторившие уже выполненный с теми же параметрами."""
+        return sum(count - 1 for count in self.statements.values())
+
+    @property
+    def similar(self):
+        """Запросы с тем же SQL и другими параметрами - признак N+1."""
+        shapes = Counter(sql for sql, _ in self.statements)
+        return sum(count - 1 for count in shapes.values())
+
+    def summary(self):
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "db_ms": round(self.db_time * 1000, 2),
+            "queries": self.queries,
+            "duplicates": self.duplicates,
+            "similar": self.similar,
+            "template_ms": round(self.template_time * 1000, 2),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+    def server_timing(self, summary):
+        # Значения заголовков - только latin-1
+        return ", ".join([
+            'db;dur=%s;desc="SQL x%s, dup %s"' % (
+                summary["db_ms"], summary["queries"], summary["duplicates"]),
+            'tpl;dur=%s;desc="Templates"' % summary["template_ms"],
+            'cache;desc="hit %s, miss %s"' % (
+                summary["cache_hits"], summary["cache_misses"]),
+            'total;dur=%s' % summary["total_ms"],
+        ])
+
+
+def current():
+    """Метрики текущего запроса или None, если он не попал в выборку."""
+    return getattr(_local, "metrics", None)
+
+
+def record_cache(hits=0, misses=0):
+    metrics = current()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, "INSTRUMENTATION_SAMPLE_RATE", 0)
+        if rate <= 0 or random.random() >= rate:
+            return self.get_response(request)
+
+        metrics = _local.metrics = RequestMetrics()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+
+        summary = metrics.summary()
+        if getattr(settings, "INSTRUMENTATION_HEADERS", False):
+            response["Server-Timing"] = metrics.server_timing(summary)
+        logger.info(json.dumps(dict(
+            summary, method=request.method, path=request.path,
+            status=response.status_code, view=getattr(
+                request.resolver_match, "view_name", None)),
+            ensure_ascii=False))
+        return response
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current()
+        if metrics is None:
+            return super().render(context, request)
+        # render() вложенных шаблонов не суммируется дважды
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates, который засекает время рендеринга для RequestMetrics."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(
+            self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
@@ -0,0 +1,93 @@
+"""Чтение с реплик и запись в основную базу.
+
+Реплики - все псевдонимы DATABASE_REPLICAS. С реплик читают только
+GET/HEAD-запросы к страницам из REPLICA_READ_VIEWS (ленты, профиль,
+пост, поиск); всё остальное, включая сигналы, фоновые потоки и команды,
+работает с default.
+
+Read-your-writes: если запрос что-то записал (new_post, add_comment,
+подписка и т.п.; признак - выполненный в default INSERT, UPDATE или
+DELETE, а не вызов db_for_write, который бывает и у чтения внутри
+get_or_create), сессия на REPLICA_PIN_SECONDS закрепляется за
+основной базой, чтобы автор сразу увидел свой пост, даже если реплика
+отстаёт. Остальные читатели могут увидеть запись с задержкой репликации,
+а кэш лент (posts/caching.py) может сохранить такое отстающее состояние
+до POSTS_CACHE_TIMEOUT, поэтому задержка реплик должна быть много меньше.
+
+    DATABASE_ROUTERS = ['yatube.routers.ReplicaRouter']
+    MIDDLEWARE = [..., 'yatube.routers.ReplicaRoutingMiddleware', ...]
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+PIN_KEY = "_db_pinned_until"
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+_local = threading.local()
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if aliases and getattr(_local, "use_replica", False):
+            return random.choice(aliases)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
+
+
+def track_writes(execute, sql, params, many, context):
+    """execute_wrapper для default: отмечает запрос, который что-то
+    записал."""
+    if sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        _local.wrote = True
+    return execute(sql, params, many, context)
+
+
+class ReplicaRoutingMiddleware:
+    """Включает чтение с реплик для разрешённых страниц. Должен стоять
+    после SessionMiddleware и AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.use_replica = _local.wrote = False
+        try:
+            with connections["default"].execute_wrapper(track_writes):
+                response = self.get_response(request)
+            if _local.wrote and replicas() and hasattr(request, "session"):
+                request.session[PIN_KEY] = time.time() + getattr(
+                    settings, "REPLICA_PIN_SECONDS", 5)
+            return response
+        finally:
+            _local.use_replica = _local.wrote = False
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not replicas() or request.method not in ("GET", "HEAD"):
+            return None
+        url_name = request.resolver_match.url_name
+        if url_name not in getattr(settings, "REPLICA_READ_VIEWS", ()):
+            return None
+        # Сессия читается здесь, ещё из default
+        session = getattr(request, "session", {})
+        _local.use_replica = session.get(PIN_KEY, 0) < time.time()
+        return None
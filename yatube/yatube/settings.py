@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -54,11 +56,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'yatube.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -67,7 +71,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'yatube.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -84,16 +88,108 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+# Метрики запросов (yatube/instrumentation.py): доля запросов в выборке
+# (локально удобно INSTRUMENTATION_SAMPLE_RATE=1) и заголовок Server-Timing
+
+INSTRUMENTATION_SAMPLE_RATE = float(
+    os.getenv('INSTRUMENTATION_SAMPLE_RATE', 0))
+INSTRUMENTATION_HEADERS = DEBUG
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'yatube.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('INSTRUMENTATION_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# Настраивается переменными окружения (или .env): DB_ENGINE=postgresql
+# для PostgreSQL, иначе SQLite в режиме WAL (yatube/sqlite_wal).
+# Соединения живут DB_CONN_MAX_AGE секунд и переиспользуются запросами.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'yatube'),
+            'USER': os.getenv('DB_USER', 'yatube'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # Пул PgBouncer в режиме transaction не поддерживает
+            # серверные курсоры (QuerySet.iterator)
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_POOL') == 'pgbouncer',
+            'OPTIONS': {'connect_timeout': 5},
+        }
     }
+    # Реплики только для чтения (yatube/routers.py)
+    for number, host in enumerate(filter(None, os.getenv(
+            'DB_REPLICA_HOSTS', '').split(',')), 1):
+        DATABASES['replica%s' % number] = dict(
+            DATABASES['default'], HOST=host.strip(),
+            TEST={'MIRROR': 'default'})
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'yatube.sqlite_wal',
+            'NAME': os.getenv('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {'timeout': float(os.getenv('DB_BUSY_TIMEOUT', 20))},
+        }
+    }
+    # Локально реплику изображает копия SQLite, которую обновляет
+    # python manage.py sync_replicas
+    if os.getenv('DB_REPLICA_NAME'):
+        DATABASES['replica'] = dict(
+            DATABASES['default'], NAME=os.getenv('DB_REPLICA_NAME'),
+            TEST={'MIRROR': 'default'})
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['yatube.routers.ReplicaRouter']
+REPLICA_READ_VIEWS = [
+    'index', 'group', 'profile', 'post', 'follow_index', 'search',
+    'trending', 'group_trending',
+    'api_posts', 'api_post', 'api_post_comments', 'api_groups',
+    'api_group_posts', 'api_user', 'api_user_posts', 'api_follow_feed',
+]
+REPLICA_PIN_SECONDS = 5
+
+
+# Сессии: cached_db - кэш (общий, без LRU воркера) перед таблицей
+# django_session, db - только таблица, signed_cookies - вся сессия в
+# подписанной cookie, без запросов к БД и кэшу. db и cached_db читают
+# одну таблицу и переключаются без потери сессий; переход на
+# signed_cookies и обратно разлогинивает всех.
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
 }
+SESSION_ENGINE = SESSION_ENGINES[os.getenv('SESSION_BACKEND', 'cached_db')]
+SESSION_CACHE_ALIAS = 'shared'
+
+# Пользователь сессии кэшируется в памяти процесса (кэш AUTH_USER_CACHE)
+# на AUTH_USER_CACHE_TIMEOUT секунд (users/backends.py), 0 - загружать из
+# БД на каждом запросе
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+AUTH_USER_CACHE = 'local'
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 30))
 
 
 # Password validation
@@ -114,12 +210,104 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Двухуровневый кэш (yatube/cache.py): LRU в памяти воркера перед общим
+# кэшем. Общий кэш - Redis (нужен пакет django-redis), если задан
+# REDIS_URL, иначе файловый кэш, общий для всех процессов на машине.
+
 CACHES = {
     'default': {
+        'BACKEND': 'yatube.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', 1000)),
+            'LOCAL_TIMEOUT': 5,
+            'SYNC_INTERVAL': 1,
+        },
+    },
+    # Только в памяти процесса: то, что нельзя класть в общий кэш
+    'local': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'LOCATION': 'yatube-local',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
 
+# Тесты очищают кэш, поэтому у них свой каталог, а не кэш dev-сервера
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL and not TESTING:
+    CACHES['shared'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+else:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'yatube_test_cache')
+        if TESTING else os.getenv(
+            'CACHE_DIR', os.path.join(tempfile.gettempdir(), 'yatube_cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
+# Время жизни кэша лент и постов; устаревание управляется событиями,
+# см. posts/caching.py
+POSTS_CACHE_TIMEOUT = 300
+
+# Комментариев на странице поста; остальные подгружаются фрагментами
+POST_COMMENTS_PER_PAGE = 50
+
+# Популярные посты (posts/trending.py): за TRENDING_HALF_LIFE секунд
+# вклад события падает вдвое; decay_trending удаляет посты с рейтингом
+# ниже TRENDING_MIN_SCORE
+TRENDING_HALF_LIFE = 6 * 3600
+TRENDING_MIN_SCORE = 0.05
+TRENDING_WEIGHTS = {"post": 1.0, "comment": 1.0, "follow": 2.0}
+
+# Больше строк - админка показывает оценку числа записей из статистики
+# СУБД вместо COUNT(*), см. posts/paginator.py
+ADMIN_EXACT_COUNT_LIMIT = 100000
+
+# Сколько секунд CDN может отдавать страницы анонимам без перепроверки,
+# см. posts/conditional.py
+HTML_EDGE_CACHE_SECONDS = int(os.getenv('HTML_EDGE_CACHE_SECONDS', 30))
+
+# Лента подписок: авторы, у которых подписчиков не меньше порога,
+# не раскладываются по лентам при публикации, а читаются при запросе.
+
+TIMELINE_FANOUT_THRESHOLD = 10000
+TIMELINE_BACKFILL_LIMIT = 1000
+TIMELINE_BATCH_SIZE = 1000
+
+# Поиск: "fts5" (SQLite), "index" (таблица SearchPosting) или "auto"
+
+POSTS_SEARCH_BACKEND = os.getenv('POSTS_SEARCH_BACKEND', 'auto')
+
+# Миниатюры создаются фоновым пулом потоков, см. posts/thumbnails.py
+
+THUMBNAIL_BACKEND = 'posts.thumbnails.DeferredThumbnailBackend'
+THUMBNAIL_DEFERRED = True
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+
+# Варианты картинки поста для srcset; последний формат - запасной
+
+POST_IMAGE_WIDTHS = (320, 640, 960)
+POST_IMAGE_FORMATS = ('WEBP', 'JPEG')
+POST_IMAGE_QUALITY = 80
+
+# Загрузки: всё крупнее 256 КБ пишется во временный файл кусками,
+# а файл больше лимита отбрасывается, не дойдя до диска (posts/uploads.py)
+
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.SizeLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+POST_IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 40000000
+POST_IMAGE_MAX_SIDE = 2048
+
 # Login
 
 LOGIN_URL = "/auth/login/"
@@ -150,6 +338,10 @@ USE_TZ = True
 
 STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
+# Хэши в именах, минификация и .gz/.br-копии при collectstatic; отдавать
+# статику самим приложением (без nginx) - SERVE_STATIC, см. yatube/assets.py
+STATICFILES_STORAGE = 'yatube.assets.CompressedManifestStaticFilesStorage'
+SERVE_STATIC = os.getenv('SERVE_STATIC', '') == '1'
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
@@ -0,0 +1,38 @@
+"""SQLite, настроенный для нескольких воркеров.
+
+WAL позволяет читателям не ждать писателя, busy timeout (OPTIONS
+"timeout", секунды) - ждать блокировку вместо мгновенного "database is
+locked", а mmap и увеличенный кэш страниц снимают часть чтений с диска.
+Транзакции начинаются с BEGIN IMMEDIATE: блокировка записи берётся
+сразу, и SQLite может подождать её по busy timeout, а не падать при
+попытке повысить уже начатую читающую транзакцию до пишущей.
+
+    'ENGINE': 'yatube.sqlite_wal',
+    'OPTIONS': {'timeout': 20, 'pragmas': {'mmap_size': 0}},
+"""
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -20000,
+    "temp_store": "MEMORY",
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = dict(PRAGMAS, **params.pop("pragmas", {}))
+        self.transaction_mode = params.pop("transaction_mode", "IMMEDIATE")
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute("PRAGMA %s = %s" % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN %s" % self.transaction_mode)